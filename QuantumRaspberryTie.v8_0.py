@@ -2,6 +2,34 @@
 #     QuantumRaspberryTie.qk2
 #       by KPRoche (Kevin P. Roche) (c) 2017,2018,2019,2020,2021,2022,2024,2025
 #
+#   ============== October 2026 Performance Updates
+#   The "thinking" rainbow is precomputed once per mask as a NumPy frame stack; blinky() just steps through it
+#   Qubit layouts are compiled into NumPy index arrays at startup (register_layout()); showqubits() is one gather
+#   Outputs are wrapped in FrameSinks that skip unchanged frames and count frames sent/skipped (shown with -debug)
+#   The display thread is paced on the monotonic clock (-fps:n) and sleeps on display_state until the main loop
+#       publishes a change; dropped frames are counted
+#   svg/pixels.html is filled from a precompiled template and written atomically, at most -svgrate:n times a second
+#   -web starts a built-in web view that pushes frames to browsers with Server-Sent Events instead of refresh polling
+#   NeoPixel frames are written to the SPI buffer in one vectorized copy through a precomputed byte map (NeoPixelMap)
+#   Transpiled circuits are cached in memory and as QPY in ./cache/transpiled, and the SamplerV2 is reused between runs
+#   JobWatcher polls job status with backoff, enforces the stall (stalled_time) and -jobtimeout limits
+#   RunScheduler waits between runs on the monotonic clock and joystick callbacks instead of spinning on process_time()
+#   -batch:K puts K circuits in each sampler job and queues their results (PatternQueue), refilling in the background
+#   -prefetch:N keeps a bounded PatternQueue N local results ahead; the main loop only pops and shows them
+#   -worker moves Aer transpile and sample to a core-pinned process (aer_worker.py); frame jitter is measured
+#   The QASM file is parsed once and kept as QPY (plus a metadata sidecar) in ./cache/circuits, keyed by its hash
+#   -watch polls the QASM file and swaps a changed circuit, engine and layout in between runs (FileWatcher)
+#   -playlist cycles precompiled circuits (circuit, engine, transpile, layout, sampler) by weighted round robin
+#   -shots plays back every shot from the result's packed BitArray, rendered as one stack of frames (ShotPlayback)
+#   Local circuits are analyzed and product-state or Clifford ones routed to a NumPy sampler or Aer's stabilizer method
+#   Other circuits on Aer get the simulation method a per-host calibration profile says is fastest
+#   Aer thread settings come from -tune (per host, width, method and kind of circuit), and otherwise leave a core free for the display
+#   Noise-modelled simulators are rebuilt offline from a saved backend snapshot, refreshed in the background when stale
+#   Qiskit, Aer and the runtime are imported only when needed, after the display shows the arrow; startup phases are timed
+#   Circuit parsing, backend setup and transpiling run in a startup thread pool while the display hardware is probed
+#   Connectivity is checked in the background (HealthCheck: keep-alive session, HEAD, timeouts, cached answer)
+#   Backend status() answers are cached for -statusttl seconds and shared between callers (BackendStatusCache)
+#
 #   ============== August 2025 Updates
 #   Updated to use new cloud.ibm.com URLs for quantum APIs
 #
@@ -75,6 +103,47 @@
 #           -d | will attempt to display on BOTH the SenseHat and a emulator display
 #               These require that both the libraries and a working version of the emulator executable be present
 #           -f:filename load an alternate QASM file
+#           -svgrate:n most writes per second of ./svg/pixels.html (default 4)
+#           -shm writes the svg display files to /dev/shm/quantum-raspberry-tie/svg instead of ./svg
+#           -web or -web:port serves a live view of the display at http://127.0.0.1:8080/ (or the given port),
+#               pushing each new frame to the browser; -webhost:address listens on another address (e.g. 0.0.0.0)
+#           -neofaux drives the pure-Python neopixel_faux stand-in instead of a real NeoPixel array (works off the Pi)
+#           -neobench times the per-pixel and bulk NeoPixel frame pushes at startup
+#           -nocache keeps parsed and transpiled circuits in memory only instead of also caching them in ./cache
+#           -jobtimeout:s cancels a job that hasn't finished after s seconds (restarted on simulators only)
+#           -jobfaux[:s|stall|cancel] makes local jobs behave like remote ones (queued s seconds, stalled, or cancelled)
+#               using the job_faux.py stand-in, to exercise the job watcher without an IBM Quantum account
+#           -interval:s seconds between runs (default 5)
+#           -batch:K runs K iterations' worth of circuits in one sampler job and shows one result per iteration,
+#               submitting the next batch in the background before the queue runs dry
+#           -prefetch[:N] keeps N results (N of at least 1, default 3) from a local simulator computed ahead in the background,
+#               so each run (or joystick press) just shows the next one
+#           -worker runs a local Aer simulator's transpiling and sampling in a separate process (aer_worker.py)
+#               pinned to its own cores, so the display thread doesn't stutter; frame jitter is shown with -debug
+#           -watch reloads the -f: QASM file whenever it is saved: the new circuit (and its display layout)
+#               is parsed, transpiled and swapped in between runs, without restarting
+#           -playlist:path cycles through every .qasm file in a folder, or the files listed in a playlist
+#               file (one per line, each optionally followed by a weight for how often it plays);
+#               every circuit is parsed, transpiled and given its display layout once, at startup
+#           -fixedrate starts a run every interval seconds, instead of waiting interval seconds after each run ends
+#           -shots[:fps] plays back every shot of each job on the display, fps a second (default 10),
+#               instead of only showing the most frequent pattern
+#           -sim:name chooses how a local simulator runs the circuit: auto (default) picks numpy for
+#               product-state circuits, stabilizer for Clifford circuits, and otherwise the Aer method
+#               (statevector, matrix_product_state or density_matrix) expected to be fastest on this host;
+#               one of those names forces that method, and aer always uses the simulator exactly as built
+#           -calibrate reruns the one-time Aer method benchmark kept in ./cache/aer_profile.json
+#           -tune times Aer's max_parallel_threads/shots/experiments settings on this circuit and saves the best
+#               for this host and circuit width in ./cache/aer_tuning.json, where later runs pick them up
+#           -snapttl:hours how old the saved backend snapshot for aermodel/aernoise can get before it is
+#               refreshed in the background (default 24)
+#           -serial runs the startup phases one after another instead of overlapping the circuit and backend
+#               setup with the display setup (to compare the startup report)
+#           -pingurl:url checks connectivity against url (also for local backends); -pingttl:s how long a
+#               check's answer is trusted (default 30); -pingfaux[:status] starts the ping_faux.py stand-in
+#               server locally and checks against that, to try the health checker offline
+#           -statusttl:s how long a backend's status is reused before IBM Quantum is asked again (default 15)
+#           -fps:n sets the frame rate of the "thinking" rainbow animation (default 30)
 # ----------------------------- pre Qiskit 1.0 History -----------------------
 #
 #     April 2023 -- added dual display option. If sensehat is available, will spin up a second emulator to show
@@ -104,7 +173,12 @@
 #----------------------------------------------------------------------
 
 
-# import most of the necessary modules. A few more will be imported later as configuration is processed.
+# import the modules needed to get the display going. Qiskit and the other heavy libraries are
+# imported later (import_qiskit(), import_aer(), import_runtime()), and only if the backend needs them,
+# so the display shows the arrow within a fraction of a second of starting.
+print("       ....time")
+from time import monotonic             # used for the loop timer and to pace the display frames
+startup_time = monotonic()             # everything in the startup report is measured from here
 print("importing libraries...")
 print("       ....sys")
 import sys                             # used to check for passed filename
@@ -112,41 +186,89 @@ print("       ....os")
 import os                              # used to find script directory
 print("       ....platform")
 import platform                        # used to detect architecture
-print("       ....psutil")
-import psutil                          # used to detect sensehat GUI
-print("       ....requests")
-import requests                        # used for ping
 print("       ....threading")
-from threading import Thread           # used to spin off the display functions
+from threading import Thread, Lock, Condition, Event, current_thread   # used to spin off the display functions
+from concurrent.futures import ThreadPoolExecutor      # runs the independent startup phases side by side
+print("       ....collections")
+from collections import deque          # used for the queue of batched results
+print("       ....copy")
+from copy import deepcopy              # used to give a circuit's engine a simulator of its own
 print("       ....colorsys")
 from colorsys import hsv_to_rgb        # used to build the color array
-print("       ....time")
-from time import process_time          # used for loop timer
 print("       ....sleep")
 from time import sleep                 #used for delays
-print("       ....qiskit QiskitRuntimeService")
-from qiskit_ibm_runtime import QiskitRuntimeService, SamplerV2, accounts  # classes for accessing IBM Quantum online services and the new SamplerV2 primitive
-from qiskit_ibm_runtime.accounts.exceptions import AccountNotFoundError   # to handle missing account info
-print("       ....QuantumCircuit and transpile")
-from qiskit import QuantumCircuit, transpile, qiskit
-print("     .....preset pass manager")
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
-print("     .....JobStatus")
-from qiskit.providers import JobStatus
-print("     .....simple local emulator (fakeManila)")
-from qiskit_ibm_runtime.fake_provider import FakeManilaV2
-print ("    .....Aer for building local simulators")#importing Aer to use local simulator")
-from qiskit_aer import Aer, qasm_simulator
+from time import time as wall_clock     # used to date cached backend snapshots
 print("       ....warnings")
 import warnings
+print("       ....hashlib, io and pickle for the circuit and backend caches")
+import hashlib
+import io
+import pickle
+print("       ....http.server and json for the built-in web view")
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
 print("       ....numpy as np for building pixel maps ")
 import numpy as np
 
-
-
-#AccountException=accounts.exception(AccountNotFoundError)
-IBMQVersion = qiskit.__version__
-print(IBMQVersion)
+#----------------------------------------------------------------------------
+#   Startup phases
+#       Each stretch of startup (imports, display setup, building the backend...) is timed,
+#       either as "with StartupPhase(name):" or between StartupPhase(name).begin() and .end(),
+#       with the thread it ran on, and startup_report() prints them as a table once the first
+#       result is on the display. A phase that ran inside another one on the same thread (an
+#       import done while building the backend) is shown indented under it.
+#----------------------------------------------------------------------------
+startup_phases = []     # (name, start, end, thread name), in seconds after startup_time
+first_frame_at = None   # when the first frame (the arrow) went to the display
+ready_at = None         # when setup was done and the first run started
+first_result_at = None  # when the first result went to the display
+
+class StartupPhase():
+    def __init__(self, name):
+        self.name = name
+
+    def begin(self):
+        self.start = monotonic() - startup_time
+        return self
+
+    def end(self):
+        startup_phases.append((self.name, self.start, monotonic() - startup_time, current_thread().name))
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, *exception):
+        self.end()
+        return False
+
+def startup_report():
+    print("startup phases (seconds after start):")
+    print(f"   {'phase':32} {'thread':12} {'start':>7} {'end':>7} {'time':>7}")
+    for phase in sorted(startup_phases, key=lambda p: (p[1], -p[2])):
+        name, start, end, thread = phase
+        depth = sum(1 for other in startup_phases
+                    if other is not phase and other[3] == thread and other[1] <= start and end <= other[2])
+        print(f"   {'  ' * depth + name:32} {thread[:12]:12} {start:7.3f} {end:7.3f} {end - start:7.3f}")
+    if first_frame_at is not None:  print(f"   first frame on the display after  {first_frame_at:7.3f} s")
+    if ready_at is not None:        print(f"   ready to run after                {ready_at:7.3f} s")
+    if first_result_at is not None: print(f"   first result on the display after {first_result_at:7.3f} s")
+
+def first_result_shown():
+    # called each time a result is published; the first time, the startup report is printed
+    global first_result_at
+    if first_result_at is not None: return
+    first_result_at = monotonic() - startup_time
+    startup_phases.append(("first run", ready_at, first_result_at, current_thread().name))
+    startup_report()
+
+startup_phases.append(("core imports", 0.0, monotonic() - startup_time, current_thread().name))
+
+# Qiskit names, filled in by import_qiskit(), import_aer() and import_runtime() when they are needed
+IBMQVersion = None
+QuantumCircuit = qpy = generate_preset_pass_manager = JobStatus = Operator = None
+BitArray = DataBin = SamplerPubResult = PrimitiveResult = BackendSamplerV2 = None
+AerSimulator = NoiseModel = None
+QiskitRuntimeService = SamplerV2 = AccountNotFoundError = FakeManilaV2 = None
 
 # --------------------------- Globals used in setting up configuration and running
 
@@ -164,6 +286,8 @@ UseQ16 = False
 UseQ32 = False
 UseLocal = True
 UseNeo = True       #enable display via neopixel array
+NeoFaux = False     # use the neopixel_faux stand-in instead of a real SPI NeoPixel array
+NeoBench = False    # time the NeoPixel frame push at startup
 NeoTiled = True     # Use the tiled Rasqberry LED pixel order. Setting False will use a single 8x32 array
 backendparm = '[localsim]'
 SelectBackend = False #for interactive selection of backend
@@ -173,6 +297,29 @@ num_shots = 50 #default number of shots for jobs
 AddNoise = False
 debug = False
 qasmfileinput='expt.qasm'
+cache_folder = './cache'    # transpiled circuits and other reusable results are kept here
+JobFaux = None              # -jobfaux[:seconds|stall|cancel] wraps each local job in a job_faux.FauxJob
+job_timeout = None          # -jobtimeout:s cancels a job that hasn't finished after s seconds
+ping_url = 'https://quantum.cloud.ibm.com/'   # -pingurl:url -- where the connectivity check looks
+ping_ttl = 30               # -pingttl:s -- how long a connectivity check result is trusted
+PingLocal = False           # check connectivity even for local backends (-pingurl, -pingfaux)
+PingFaux = None             # -pingfaux[:status] starts the ping_faux.py stand-in server and checks it instead
+status_ttl = 15             # -statusttl:s -- how long a backend's status() answer is reused
+UseDiskCache = True         # -nocache keeps the caches in memory only
+frame_rate = 30    # target frames per second for the rainbow animation
+interval = 5       # seconds between runs
+FixedRate = False  # start runs every interval seconds instead of interval seconds after the last one ended
+ShotFps = 0        # -shots[:fps] plays back every shot of a job at fps frames per second (0: just show the max pattern)
+EngineChoice = 'auto'   # -sim:name picks how a local simulator runs the circuit (auto, numpy, stabilizer, aer or an Aer method)
+Recalibrate = False     # -calibrate reruns the Aer method benchmark even if this host already has a profile
+Tune = False            # -tune benchmarks Aer's thread and parallelism options for this circuit and saves the best
+snapshot_ttl = 24 * 3600    # -snapttl:hours -- how old a backend snapshot can get before it is refreshed
+SerialStartup = False   # -serial runs the startup phases one after another instead of side by side
+BatchRuns = 0      # -batch:K runs K iterations' worth of circuits in each sampler job (0: one job per iteration)
+Prefetch = 0       # -prefetch[:N] keeps N local results computed ahead of the display (0: run each job when it's due)
+UseWorker = False  # -worker transpiles and samples in a separate process (aer_worker.py) on cores of its own
+WatchFile = False  # -watch reloads the QASM file whenever it changes, without restarting
+PlaylistPath = None     # -playlist:path cycles through a folder of QASM files or a playlist file
 
 #---------------------- GRAPHICS constants and functions-------------------------------------------
 
@@ -208,7 +355,68 @@ ibm_qx32 = [[ 0],   [ 2],   [ 4],   [ 6],
                 [41],   [43],   [45],   [47],
             [48],   [50],   [52],   [54],
                 [57],   [59],   [61],   [63]
-            ]            
+            ]
+
+#----------------------------------------------------------------------------
+#   Layout compiler
+#       Each qubit layout above is turned once into a pair of NumPy index arrays:
+#       the pixels it lights, and which qubit each of those pixels belongs to.
+#       Rendering a measured bit pattern is then a single gather into the color palette.
+#       New layouts of any size only need a register_layout() call.
+#----------------------------------------------------------------------------
+# palette index: 0 = measured "0" (red), 1 = measured "1" (blue), 2 = unmeasured qubit (dim purple)
+qubit_palette = np.array([[255, 0, 0], [0, 0, 255], [75, 0, 75]], dtype=np.uint8)
+
+class CompiledLayout():
+    def __init__(self, name, groups):
+        self.name = name
+        self.groups = groups           # the original list of pixel lists, one per qubit
+        self.pixel_index = np.array([p for group in groups for p in group], dtype=np.intp)
+        self.pixel_qubit = np.array([q for q, group in enumerate(groups) for p in group], dtype=np.intp)
+        self.qubit_number = np.arange(len(groups))
+
+    # behave like the plain layout list so len(display) and "for group in display" keep working
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __getitem__(self, q):
+        return self.groups[q]
+
+    def bits(self, pattern):
+        # '1' characters -> 1, anything else -> 0, padded with 0s or truncated to the layout width
+        measured = np.frombuffer(pattern.encode('ascii'), dtype=np.uint8)[:len(self.groups)] == ord('1')
+        bits = np.zeros(len(self.groups), dtype=np.uint8)
+        bits[:len(measured)] = measured
+        return bits
+
+    def shot_bits(self, shots):
+        # shots is one row of 0/1 values per shot, in bit-string order; padded or truncated like bits()
+        bits = np.zeros((len(shots), len(self.groups)), dtype=np.uint8)
+        width = min(shots.shape[1], len(self.groups))
+        bits[:, :width] = shots[:, :width]
+        return bits
+
+    def render(self, bits, measured_qubits):
+        # bits is one 0/1 value per qubit; returns a 64x3 uint8 frame
+        # (or a stack of frames, one per row, if bits is 2-D)
+        state = bits.astype(np.intp)
+        state[(bits == 0) & (self.qubit_number >= measured_qubits)] = 2
+        frame = np.zeros(bits.shape[:-1] + (64, 3), dtype=np.uint8)
+        frame[..., self.pixel_index, :] = qubit_palette[state[..., self.pixel_qubit]]
+        return frame
+
+display_layouts = {}   # compiled layouts by name
+
+def register_layout(name, groups):
+    display_layouts[name] = CompiledLayout(name, groups)
+    return display_layouts[name]
+
+for layout_name, layout_groups in (('ibm_qx5', ibm_qx5), ('ibm_qx5t', ibm_qx5t), ('ibm_qhex', ibm_qhex),
+                                   ('ibm_qx16', ibm_qx16), ('ibm_qx32', ibm_qx32)):
+    register_layout(layout_name, layout_groups)
 
 # global to spell OFF in a single operation
 X = [255, 255, 255]  # white
@@ -337,6 +545,36 @@ hues = [
 pixels = [hsv_to_rgb(h, 1.0, 1.0) for h in hues]
 qubits = pixels
 
+#----------------------------------------------------------------------------
+#   Precomputed rainbow animation
+#       The whole hue cycle (RAINBOW_STEPS frames of RAINBOW_STEP each) is converted
+#       to RGB once per mask and kept as a NumPy frame stack, so the display thread
+#       only has to pick the next frame instead of redoing the HSV math 64 times
+#----------------------------------------------------------------------------
+RAINBOW_STEP = 0.01
+RAINBOW_STEPS = 100
+rainbow_phase = 0      # index of the next frame in the hue cycle; shared so the wash continues between calls
+rainbow_rings = {}     # RainbowRing objects already built, keyed by the set of pixels they light
+
+class RainbowRing():
+    def __init__(self, mask):
+        lit = np.zeros(64, dtype=bool)
+        lit[[p for group in mask for p in group]] = True
+        base = np.array(hues)
+        # frame k is the wash after k+1 rotations, matching the old per-frame hue rotation
+        rotated = (base[None, :] + RAINBOW_STEP * np.arange(1, RAINBOW_STEPS + 1)[:, None]) % 1.0
+        rgb = [[hsv_to_rgb(h, 1.0, 1.0) for h in frame] for frame in rotated]
+        self.frames = (np.array(rgb) * 255).astype(np.uint8)   # same truncation as scale()
+        self.frames[:, ~lit] = 0
+        # the SenseHat API wants plain lists of ints, so convert each frame once here too
+        self.lists = [frame.tolist() for frame in self.frames]
+
+def rainbow_ring(mask):
+    key = tuple(sorted(set(p for group in mask for p in group)))
+    if key not in rainbow_rings:
+        rainbow_rings[key] = RainbowRing(mask)
+    return rainbow_rings[key]
+
 # scale lets us do a simple color rotation of hues and convert it to RGB in pixels
 
 # LED array indices to map to pixel list
@@ -397,50 +635,45 @@ matrix_map2 = create_matrix_map(8, 16)
 
 #----------------------------------------------------------------------------
 #       Create a SVG rendition of the pixel array
+#           the markup never changes except for the 64 fill colors and the caption,
+#           so it is built once as a template with a slot for each of those
 #----------------------------------------------------------------------------
+svg_folder = './svg'    # where qubits.html and pixels.html are written (-shm moves it to /dev/shm)
+svg_rate = 4            # most pixels.html writes per second; a changed frame arriving sooner waits its turn
+
+svg_template = ('<svg width="128" height="128" version="1.1" xmlns="http://www.w3.org/2000/svg">\n'
+                + ''.join(f'<rect x="{16 * (i % 8)}" y="{16 * (i // 8)}" fill="rgb({{{i}}})" '
+                          'width="16" height="16" stroke="white" stroke-width="1"/>\n' for i in range(64))
+                + '</svg>')
+svg_page_template = svg_template + '\r <br/>Qubit Pattern: {64}<br/><br/>\r'
+
+def svg_fills(pixel_list, brighten=1):
+    rgb = np.asarray(pixel_list, dtype=float)
+    if brighten > 0:
+        rgb = np.minimum((rgb * brighten).astype(int), 255)
+    return [f"{r},{g},{b}" for r, g, b in rgb.astype(int).tolist()]
+
 def svg_pixels(pixel_list, brighten=1):
-    # Create canvas
-    svg_inline = '<svg width="128" height="128" version="1.1" xmlns="http://www.w3.org/2000/svg">\n'
-    # fill canvas with black background
-    #svg_inline = svg_inline +   '<rect x="0" y="0" width="128" height="128" stroke="black" fill="black" stroke-width="0"/>\n'
-    # iterate through the list
-    for i in range(64):
-        # get the coordinates
-        x = 4 * 4 * (i % 8)
-        y = 4 * 4 * (i//8)
-        pixel=pixel_list[i]
-        red=pixel[0]
-        green=pixel[1]
-        blue=pixel[2]
-        if brighten > 0:
-            red = min(int(red * brighten),255)
-            green = min(int(green * brighten),255)
-            blue = min(int(blue * brighten),255)
-        # build the "pixel" rectangle and append it
-        pixel_str=f'<rect x="{x}" y="{y}" fill="rgb({red},{green},{blue})" width="16" height="16" stroke="white" stroke-width="1"/>\n'
-        svg_inline = svg_inline + pixel_str
-
-    #close the svg
-    svg_inline = svg_inline + "</svg>"
-        
-    return svg_inline
+    return svg_template.format(*svg_fills(pixel_list, brighten))
+
+# write through a temporary file and rename it into place, so a browser never reads a half-written page
+def write_atomic(path, text):
+    temp_path = path + '.tmp'
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(text)
+    os.replace(temp_path, path)
 
 #------------------------------------------------------------------
 #	Write the SVG out as a file
-#------------------------------------------------------------------    
+#------------------------------------------------------------------
 def write_svg_file(pixels, label='0000', brighten=1, init=False):
     # This uses multiple files to create the webpage qubit display:
     # qubits.html is only written if init is True
-    #      It contains the refresh command and the html structure, and pulls in the other two
-    # pixels.svg holds the display pattern
-    # pixels.lbl holds the caption
+    #      It contains the refresh command and the html structure, and pulls in pixels.html
+    # pixels.html holds the display pattern and its caption
     if init:
-        print("initializing html wrapper for svg display")
-        try: #create the svg directory if it doesn't exist yet
-            os.mkdir(r'./svg')
-        except OSError as error:
-            print(error)
-        html_file = open (r'./svg/qubits.html',"w")
+        print("initializing html wrapper for svg display in", svg_folder)
+        os.makedirs(svg_folder, exist_ok=True)    #create the svg directory if it doesn't exist yet
         browser_str='''<!DOCTYPE html>\r<html>\r<head>\r
                                 <title>SenseHat Display</title>\r
                                 <meta http-equiv="refresh" content="2.5">\r
@@ -448,23 +681,10 @@ def write_svg_file(pixels, label='0000', brighten=1, init=False):
                                 <h3>Latest Display on RPi SenseHat</h3>\r
                                 <object data="pixels.html"  width='400' height='500'/ >\r
                                 </body></html>'''
-        #browser_str = browser_str + '<br> Qubit Pattern: ' + label + '</body></html>'
-        html_file.write(browser_str)
-        html_file.close()        
-       
-    svg_file = open (r'./svg/pixels.html',"w")
-    #lbl_file = open (r'./svg/pixels.lbl',"w")
-    #browser_str='''<!DOCTYPE html>\r<html>\r<head>\r
-    #                            <title>SenseHat Display</title>\r
-    #                            <meta http-equiv="refresh" content="1">\r
-    #                            </head>\r<body>\r
-    #                            <h3>Latest Display on RPi SenseHat</h3>'''
-    browser_str= svg_pixels(pixels, brighten) + '\r <br/>Qubit Pattern: ' + label + '<br/><br/>\r'
-    svg_file.write(browser_str)
-    svg_file.close()  
-    #browser_str = 'Qubit Pattern: ' + label + '\r'
-    #lbl_file.write(browser_str)
-    #lbl_file.close()      
+        write_atomic(os.path.join(svg_folder, 'qubits.html'), browser_str)
+
+    browser_str = svg_page_template.format(*svg_fills(pixels, brighten), label)
+    write_atomic(os.path.join(svg_folder, 'pixels.html'), browser_str)
 
 #-- scale lets us scale a fraction of 255
 def scale(v):
@@ -494,6 +714,277 @@ def display_to_LEDs(pixel_list, LED_array_indices):
     
     neopixel_array.show()
 
+#----------------------------------------------------------------------------
+#   Frame sinks with dirty-frame detection
+#       Every output (SenseHat, second display, NeoPixels, svg file) is wrapped in a FrameSink
+#       that remembers the last frame it was sent. push_frame() skips any sink whose frame
+#       (and caption, for sinks that show one) is unchanged, and counts what was sent and skipped.
+#----------------------------------------------------------------------------
+class FrameSink():
+    def __init__(self, name, write, labelled=False, animated=True, array=False):
+        self.name = name
+        self.write = write            # called as write(pixel_list, label)
+        self.labelled = labelled      # the caption is part of what this sink shows
+        self.animated = animated      # False for sinks that only show results, not the "thinking" rainbow
+        self.array = array            # write() takes the 64x3 uint8 frame itself instead of a pixel list
+        self.last = None
+        self.sent = 0
+        self.skipped = 0
+
+    def unchanged(self, key, label):
+        if self.labelled: key = (key, label)
+        if key == self.last:
+            self.skipped += 1
+            return True
+        self.last = key
+        return False
+
+    def flush(self):
+        pass        # only sinks that hold frames back (SvgSink) have anything to do here
+
+    def flush_delay(self):
+        return None # seconds until flush() has something to write, or None
+
+#   the svg sink writes at most svg_rate times a second; a frame that arrives too soon is
+#   kept as pending and written by flush() once its turn comes, so the file never ends up stale
+class SvgSink(FrameSink):
+    def __init__(self, name, brighten=2.5):
+        FrameSink.__init__(self, name, self.write_page, labelled=True, animated=False)
+        self.brighten = brighten
+        self.last_write = None
+        self.pending = None
+
+    def write_page(self, pixel_list, label):
+        now = monotonic()
+        if self.last_write is not None and now - self.last_write < 1.0 / svg_rate:
+            self.pending = (pixel_list, label)
+            return
+        self.pending = None
+        self.last_write = now
+        write_svg_file(pixel_list, label, self.brighten, False)
+
+    def flush(self):
+        if self.pending is not None and self.flush_delay() == 0:
+            self.write_page(*self.pending)
+
+    def flush_delay(self):
+        if self.pending is None: return None
+        return max(0.0, self.last_write + 1.0 / svg_rate - monotonic())
+
+frame_sinks = []
+frame_lock = Lock()    # the main loop and the display thread can both push frames
+
+def push_frame(frame, label='', pixel_list=None, animation=False):
+    # frame is a 64x3 uint8 array; pixel_list is an optional ready-made list version of it
+    key = frame.tobytes()
+    with frame_lock:
+        for sink in frame_sinks:
+            if animation and not sink.animated: continue
+            if sink.unchanged(key, label): continue
+            if sink.array:
+                sink.write(frame, label)
+            else:
+                if pixel_list is None: pixel_list = frame.tolist()
+                sink.write(pixel_list, label)
+            sink.sent += 1
+
+def flush_frame_sinks():
+    with frame_lock:
+        for sink in frame_sinks: sink.flush()
+
+def flush_delay():
+    # how long the display thread may sleep before a held-back frame is due
+    delays = [d for d in (sink.flush_delay() for sink in frame_sinks) if d is not None]
+    return min(delays) if delays else None
+
+def frame_stats():
+    return ", ".join(f"{sink.name}: {sink.sent} sent/{sink.skipped} skipped" for sink in frame_sinks)
+
+#----------------------------------------------------------------------------
+#   Bulk NeoPixel frame push
+#       For the active tiling mode (NeoTiled, a single 8x32, or 8x32 with DualNEO) each color of
+#       each of the 64 frame pixels is given its byte position in the NeoPixel buffer once, with
+#       PIXEL_ORDER folded in, and brightness becomes a 256-entry lookup table. Writing a frame is
+#       then one gather and one scatter straight into the buffer that show() sends.
+#----------------------------------------------------------------------------
+class NeoPixelMap():
+    def __init__(self, led_maps, pixel_order, brightness, offset=0):
+        bpp = len(pixel_order)
+        channel_offset = np.array([pixel_order.index(c) for c in "RGB"])
+        targets = [offset + np.array([led_map[i] for i in range(64)])[:, None] * bpp + channel_offset[None, :]
+                   for led_map in led_maps]
+        self.byte_index = np.concatenate(targets).reshape(-1)            # where each value lands in the buffer
+        self.source_index = np.tile(np.arange(192), len(led_maps))       # which frame value it is
+        self.levels = (np.arange(256) * brightness).astype(np.uint8)     # same int() truncation as the library
+
+    def write(self, frame, buffer):
+        buffer[self.byte_index] = self.levels[frame.reshape(-1)[self.source_index]]
+
+def neopixel_led_maps():
+    if NeoTiled:  return [RQ2_array_indices]
+    elif DualNEO: return [matrix_map, matrix_map2]
+    else:         return [matrix_map]
+
+neo_frame_map = None
+neo_buffer = None   # NumPy view of the library's pixel buffer, if it exposes one
+
+def setup_neopixel_map():
+    global neo_frame_map, neo_buffer
+    neo_frame_map = NeoPixelMap(neopixel_led_maps(), PIXEL_ORDER, BRIGHTNESS, getattr(neopixel_array, '_offset', 0))
+    try:
+        neo_buffer = np.frombuffer(neopixel_array._post_brightness_buffer, dtype=np.uint8)
+    except AttributeError:
+        print("NeoPixel library does not expose its pixel buffer; using per-pixel updates")
+        neo_buffer = None
+
+def write_LEDs(frame, label=''):
+    if neo_buffer is not None:
+        neo_frame_map.write(frame, neo_buffer)
+        neopixel_array.show()
+    else:
+        pixel_list = frame.tolist()
+        for led_map in neopixel_led_maps():
+            display_to_LEDs(pixel_list, led_map)
+
+def neopixel_benchmark(frames=300):
+    # compare the old per-pixel update with the bulk push, on the rainbow frames
+    ring = rainbow_ring(QKLogo_mask)
+    start = monotonic()
+    for n in range(frames):
+        for led_map in neopixel_led_maps():
+            display_to_LEDs(ring.lists[n % RAINBOW_STEPS], led_map)
+    per_pixel = monotonic() - start
+    start = monotonic()
+    for n in range(frames):
+        write_LEDs(ring.frames[n % RAINBOW_STEPS])
+    bulk = monotonic() - start
+    print(f"NeoPixel push, {frames} frames: per-pixel {frames / per_pixel:.0f} frames/s, bulk {frames / bulk:.0f} frames/s")
+
+#----------------------------------------------------------------------------
+#   Built-in web view
+#       -web[:port] starts a small HTTP server (loopback only, unless -webhost:address is given)
+#       that serves a page at / and pushes each changed frame to every open page as a
+#       Server-Sent Event on /frames. A frame is encoded once, as 64 hex RGB triples plus the
+#       caption, and shared by all viewers; a slow viewer just skips to the latest frame.
+#----------------------------------------------------------------------------
+web_port = None
+web_host = '127.0.0.1'
+web_sink = None
+
+class WebSink(FrameSink):
+    def __init__(self, name, brighten=2.5):
+        FrameSink.__init__(self, name, self.publish_frame, labelled=True, animated=True)
+        self.brighten = brighten
+        self.changed = Condition()
+        self.sequence = 0
+        self.payload = json.dumps({"p": "00" * 192, "l": ""})
+        self.viewers = 0            # pages streaming /frames right now (changed by the handler threads)
+
+    def viewer(self, change):
+        # a viewer connected (+1) or left (-1)
+        with self.changed:
+            self.viewers += change
+            viewers = self.viewers
+        print("web view:", viewers, "viewer" if viewers == 1 else "viewers")
+
+    def publish_frame(self, pixel_list, label):
+        rgb = np.minimum((np.asarray(pixel_list, dtype=float) * self.brighten).astype(int), 255).astype(np.uint8)
+        payload = json.dumps({"p": rgb.tobytes().hex(), "l": label}, separators=(',', ':'))
+        with self.changed:
+            self.payload = payload
+            self.sequence += 1
+            self.changed.notify_all()
+
+    def next_payload(self, seen, timeout):
+        # block until a frame newer than seen is published; returns (sequence, payload)
+        with self.changed:
+            self.changed.wait_for(lambda: self.sequence != seen, timeout)
+            return self.sequence, self.payload
+
+web_page = """<!DOCTYPE html>
+<html><head><title>SenseHat Display</title></head>
+<body>
+<h3>Latest Display on RPi SenseHat</h3>
+<svg id="grid" width="128" height="128" version="1.1" xmlns="http://www.w3.org/2000/svg"></svg>
+<br/>Qubit Pattern: <span id="label"></span>
+<script>
+var grid = document.getElementById("grid"), rects = [];
+for (var i = 0; i < 64; i++) {
+  var r = document.createElementNS("http://www.w3.org/2000/svg", "rect");
+  r.setAttribute("x", 16 * (i % 8)); r.setAttribute("y", 16 * Math.floor(i / 8));
+  r.setAttribute("width", 16); r.setAttribute("height", 16);
+  r.setAttribute("stroke", "white"); r.setAttribute("stroke-width", 1); r.setAttribute("fill", "black");
+  grid.appendChild(r); rects.push(r);
+}
+new EventSource("/frames").onmessage = function (event) {
+  var frame = JSON.parse(event.data);
+  for (var i = 0; i < 64; i++) rects[i].setAttribute("fill", "#" + frame.p.substr(6 * i, 6));
+  if (frame.l) document.getElementById("label").textContent = frame.l;
+};
+</script>
+</body></html>
+""".encode()
+
+class WebViewHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path in ('/', '/index.html', '/qubits.html'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(web_page)))
+            self.end_headers()
+            self.wfile.write(web_page)
+        elif self.path == '/frames':
+            self.stream_frames()
+        else:
+            self.send_error(404)
+
+    def stream_frames(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        web_sink.viewer(+1)
+        seen = None
+        try:
+            while True:
+                sequence, payload = web_sink.next_payload(seen, 15)
+                if sequence == seen:
+                    self.wfile.write(b': keepalive\n\n')    # nothing new; keeps proxies and browsers from timing out
+                else:
+                    self.wfile.write(b'data: ' + payload.encode() + b'\n\n')
+                    seen = sequence
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass        # the viewer closed the page
+        finally:
+            web_sink.viewer(-1)
+
+    def log_message(self, format, *args):
+        if debug: BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def start_web_server():
+    server = ThreadingHTTPServer((web_host, web_port), WebViewHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f"web view running at http://{web_host}:{web_port}/")
+    return server
+
+def build_frame_sinks():
+    # called once the display hardware has been probed
+    frame_sinks.clear()
+    if not NoHat: frame_sinks.append(FrameSink("SenseHat", lambda pixel_list, label: hat.set_pixels(pixel_list)))
+    if DualDisplay and not NoHat: frame_sinks.append(FrameSink("second display", lambda pixel_list, label: hat2.set_pixels(pixel_list)))
+    if UseNeo: frame_sinks.append(FrameSink("NeoPixels", write_LEDs, array=True))
+    frame_sinks.append(SvgSink("svg"))
+    if web_port:
+        global web_sink
+        web_sink = WebSink("web")
+        frame_sinks.append(web_sink)
+
+# the fixed images as frames
+Arrow_frame = np.array(Arrow, dtype=np.uint8)
+QKLogo_frame = np.array(QKLogo, dtype=np.uint8)
+
 
 #----------------------------------------------------------------
 # Set the display size and rotation And turn on the display with an mask logo
@@ -542,121 +1033,99 @@ def orient():
 
 # -- showqubits maps a bit pattern (a string of up to 16 0s and 1s) onto the current display template
 def showqubits(pattern='0000000000000000'):
-   global hat, qubits
-   padding=''
-   svgpattern=pattern
-   if len(pattern)<len(display):
-       for x in range(len(display)-len(pattern)):
-            padding = padding + '0'
-       pattern = pattern + padding
-   for p in range(64):          #first set all pixels off
-           pixels[p]=[0,0,0]
-   for q in range(len(display)):
-      if pattern[q]=='1':         # if the digit is "1" assign blue
-         for p in display[q]:
-            pixels[p]=[0,0,255]
-      elif q >= qubits_needed:
-         for p in display[q]:    # if outside the number of measured qubits in the circuit, dim purple
-            pixels[p]=[75,0,75]
-      else:                       # otherwise assign it red
-         for p in display[q]:     
-            pixels[p]=[255,0,0]
-   qubits=pixels
+   global hat, qubits, pixels
+   # "1" is blue, "0" is red, and display qubits beyond the circuit width are dim purple
+   frame = display.render(display.bits(pattern), qubits_needed)
    qubitpattern=pattern
 
-   # Test for LED array
-   if UseNeo:
-    #neopixel_array.clear()
-    #neopixel_array.show()   
-    display_to_LEDs(pixels, LED_array_indices)
-    if DualNEO and not NeoTiled: display_to_LEDs(pixels, matrix_map2)
-
-   if not NoHat: hat.set_pixels(pixels)         # turn them all on   <== THIS IS THE STEP THAT WRITES TO THE MAIN 8x8 Hat array
-   write_svg_file(pixels, svgpattern, 2.5, False)
-   if DualDisplay and not NoHat: hat2.set_pixels(pixels)  #           <== THIS WRITES THE PATTERN TO A SECONDARY 8x8 DISPLAY
-   #write_svg_file(qubits,2.5)
+   # writes the SenseHat, second display, NeoPixels and svg file -- but only the ones whose frame changed
+   push_frame(frame, pattern)
+   pixels = frame.tolist()
+   qubits=pixels
    
 #--------------------------------------------------
 #    blinky lets us use the rainbow rotation code to fill the bowtie pattern
-#       it can be interrupted by tapping the joystick or if
-#       an experiment ID is provided and the 
-#       status returns "DONE"
-#
-#	We're going to put it into a class so it can be launched in a parallel thread
+#       each call draws the next frame of the precomputed hue cycle;
+#       steps > 1 skips ahead so the wash keeps wall-clock speed when frames are dropped
 #------------------------------------------------------
 
-def blinky(time=20,experimentID=''):
-   global pixels,hues,experiment, Qlogo, showlogo, QArcs, QKLogo, QHex, qubits, qubitpattern, qubits_needed, qdone
+def blinky(steps=1):
+   global pixels, rainbow_phase
    if QWhileThinking:
        mask = QKLogo_mask
    else:
        mask = display
-   #resetrainbow()
-   count=0
-   GoNow=False
-   while ((count*.02<time) and (not GoNow)):
-      #if qubits_needed < 17:  
-      # Rotate the hues
-      hues = [(h + 0.01) % 1.0 for h in hues]
-      # Convert the hues to RGB values
-      pixels = [hsv_to_rgb(h, 1.0, 1.0) for h in hues]
-      # hsv_to_rgb returns 0..1 floats; convert to ints in the range 0..255
-      pixels = [(scale(r), scale(g), scale(b)) for r, g, b in pixels]
-      for p in range(64):
-         #if QWhileThinking:
-         #    if p in sum(Qlogo,[]):
-          #       pass
-          #   else:
-          #       pixels[p]=[0,0,0]
-        # else:
-             if p in sum(mask,[]):
-             #if p in sum(display,[]):
-                pass
-             else:
-                pixels[p]=[0,0,0]
-      if (result is not None):
-         if qdone: #(result.status=='COMPLETED'): #qdone already samples the job status
-            GoNow=True
-    # Update the display
-      if not showlogo:
-          if not NoHat: hat.set_pixels(pixels)
-          if DualDisplay and not NoHat: hat2.set_pixels(pixels)
-          if UseNeo: 
-            display_to_LEDs(pixels, LED_array_indices)
-            if DualNEO and not NeoTiled: display_to_LEDs(pixels, matrix_map2)
-      else:
-          if not NoHat: hat.set_pixels(QKLogo)
-          if DualDisplay and not NoHat: hat2.set_pixels(QKLogo)
-          if UseNeo: 
-            display_to_LEDs(QKLogo, LED_array_indices)
-            if DualNEO and not NeoTiled: display_to_LEDs(pixels, matrix_map2)
-      sleep(0.002)
-      count+=1
-      if not NoHat:
-          for event in hat.stick.get_events():
-             if event.action == 'pressed':
-                goNow=True
-             if event.action == 'held' and event.direction =='middle':
-                shutdown=True 
+   ring = rainbow_ring(mask)    # built on first use for this mask, then just looked up
+   frame_number = rainbow_phase
+   pixels = ring.lists[frame_number]
+   rainbow_phase = (rainbow_phase + steps) % RAINBOW_STEPS
+   push_frame(ring.frames[frame_number], pixel_list=pixels, animation=True)
+
+#------------------------------------------------
+#  DisplayState is what the main loop wants on the display right now.
+#     The main loop calls publish() whenever that changes (thinking, logo, result pattern, shutdown)
+#     and the display thread sleeps on the condition until it does.
+#------------------------------------------------
+class DisplayState():
+   def __init__(self):
+      self.changed = Condition()
+      self.version = 0          # bumped on every publish so the display thread can tell something changed
+      self.thinking = False     # show the rainbow (or logo) instead of the result
+      self.logo = False         # while thinking, hold the static logo instead of animating
+      self.pattern = '00000'    # the result bit pattern to show when not thinking
+      self.shots = None         # a ShotPlayback to cycle through instead of the pattern (-shots)
+      self.shutdown = False     # turn the display off and shut the Pi down
+
+   def publish(self, **state):
+      with self.changed:
+         for name, value in state.items():
+            setattr(self, name, value)
+         self.version += 1
+         self.changed.notify_all()
+
+   def wait(self, seen_version, timeout=None):
+      # sleep until something newer than seen_version is published, or the timeout runs out
+      if timeout is not None and timeout <= 0: return
+      with self.changed:
+         self.changed.wait_for(lambda: self.version != seen_version, timeout)
+
+display_state = DisplayState()
 
 #------------------------------------------------
 #  now that the light pattern functions are defined,
 #    build a class glow so we can launch display control as a thread
+#    the rainbow is paced against the monotonic clock at frame_rate frames per second;
+#    anything static (logo, result) is drawn once and then the thread sleeps until the state changes
 #------------------------------------------------
 class glow():
-   global thinking,hat, maxpattern, shutdown,off,Qlogo, QArcs, Qhex, qubits_needed
 
-   def __init__(self):
+   def __init__(self, fps=30):
       self._running = True
+      self.frame_time = 1.0 / fps
+      self.frames = 0           # rainbow frames drawn
+      self.dropped = 0          # rainbow frame slots missed because drawing fell behind the clock
+      self.shots_shown = 0      # shot playback frames drawn
+      self.lateness = deque(maxlen=5000)    # seconds each recent rainbow frame started after its slot (jitter)
       
    def stop(self):
       self._running = False
       self._stop = True
+      display_state.publish()   # wake the thread so it sees _running is off
+
+   def stats(self):
+      text = f"{self.frames} frames drawn, {self.dropped} dropped, {self.shots_shown} shots played back"
+      if self.lateness:
+         late = np.array(self.lateness) * 1000
+         text += f", frame jitter mean {late.mean():.1f} p99 {np.percentile(late, 99):.1f} max {late.max():.1f} ms"
+      return text
 
    def run(self):
-      #thinking=False
+      next_frame = monotonic()
+      animating = False
+      shown = None              # the ShotPlayback being played
       while self._running:
-         if shutdown:
+         seen = display_state.version
+         if display_state.shutdown:
             if not NoHat: hat.set_rotation(angle)
             if not NoHat: hat.set_pixels(off)
             sleep(1)
@@ -664,51 +1133,1385 @@ class glow():
             if DualDisplay and not NoHat: hat2.clear()
             path = 'sudo shutdown -P now '
             os.system (path)
+            self._running = False
+         elif display_state.thinking and not display_state.logo:
+            now = monotonic()
+            if not animating:            # start the clock fresh when the rainbow starts
+               next_frame = now
+               animating = True
+            missed = 0
+            self.lateness.append(max(0.0, now - next_frame))
+            if now - next_frame >= self.frame_time:   # fell a whole frame or more behind: skip ahead
+               missed = int((now - next_frame) / self.frame_time)
+               self.dropped += missed
+               next_frame += missed * self.frame_time
+            blinky(1 + missed)
+            flush_frame_sinks()
+            self.frames += 1
+            next_frame += self.frame_time
+            display_state.wait(seen, next_frame - monotonic())
+         elif not display_state.thinking and display_state.shots is not None:
+            playback = display_state.shots
+            animating = False
+            if playback is not shown:    # a new job's shots: start from the first one
+               playback_start = monotonic()
+               shown = playback
+            # which shot is due is worked out from the clock, so a late frame never slows the playback down
+            shot = int((monotonic() - playback_start) / playback.frame_time)
+            push_frame(playback.frames[shot % len(playback)], playback.labels[shot % len(playback)])
+            flush_frame_sinks()
+            self.shots_shown += 1
+            display_state.wait(seen, playback_start + (shot + 1) * playback.frame_time - monotonic())
          else:
-           if thinking: # and qubits_needed < 17:
-              blinky(.1)
-           else:
-              showqubits(maxpattern)
+            animating = False
+            shown = None
+            if display_state.thinking:
+               push_frame(QKLogo_frame, pixel_list=QKLogo, animation=True)
+            else:
+               showqubits(display_state.pattern)
+            display_state.wait(seen, flush_delay())
+            flush_frame_sinks()
               
 ###############################    END DISPLAY FUNCTIONS
 
 ###############################    QISKIT/BACKEND SETUP FUNCTIONS
 
+#----------------------------------------------------------------------------
+#   Lazy imports
+#       qiskit is needed for any circuit; qiskit_aer for local simulators (including the
+#       noise-modelled ones); qiskit_ibm_runtime only to reach IBM Quantum or for FakeManilaV2.
+#       Each is imported the first time it is needed, and timed as a startup phase.
+#----------------------------------------------------------------------------
+def import_qiskit():
+    global IBMQVersion, QuantumCircuit, qpy, generate_preset_pass_manager, JobStatus, Operator
+    global BitArray, DataBin, SamplerPubResult, PrimitiveResult, BackendSamplerV2
+    if QuantumCircuit is not None: return
+    with StartupPhase("import qiskit"):
+        print("       ....QuantumCircuit")
+        import qiskit
+        from qiskit import QuantumCircuit
+        print("     .....preset pass manager")
+        from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+        print("     .....qpy for caching circuits")
+        from qiskit import qpy
+        print("     .....JobStatus")
+        from qiskit.providers import JobStatus
+        print("     .....Operator and primitive classes for the samplers")
+        from qiskit.quantum_info import Operator
+        from qiskit.primitives import BitArray, DataBin, SamplerPubResult, PrimitiveResult, BackendSamplerV2
+        IBMQVersion = qiskit.__version__
+        print(IBMQVersion)
+
+def import_aer():
+    global AerSimulator, NoiseModel
+    if AerSimulator is not None: return
+    with StartupPhase("import qiskit_aer"):
+        print ("    .....Aer for building local simulators")
+        from qiskit_aer import AerSimulator
+        from qiskit_aer.noise import NoiseModel
+
+def import_runtime():
+    global QiskitRuntimeService, SamplerV2, AccountNotFoundError, FakeManilaV2
+    if QiskitRuntimeService is not None: return
+    with StartupPhase("import qiskit_ibm_runtime"):
+        print("       ....qiskit QiskitRuntimeService")
+        from qiskit_ibm_runtime import QiskitRuntimeService, SamplerV2  # classes for accessing IBM Quantum online services and the new SamplerV2 primitive
+        from qiskit_ibm_runtime.accounts.exceptions import AccountNotFoundError   # to handle missing account info
+        print("     .....simple local emulator (fakeManila)")
+        from qiskit_ibm_runtime.fake_provider import FakeManilaV2
+
+def is_aer(backend):
+    return AerSimulator is not None and isinstance(backend, AerSimulator)
+
 #   Connection functions
 #       ping and authentication
 
 #----------------------------------------------------------------------------
-# set up a ping function so we can confirm the service can connect before we attempt it
-#           ping uses the requests library
-#           based on pi-ping by Wesley Archer (raspberrycoulis) (c) 2017
-#           https://github.com/raspberrycoulis/Pi-Ping
+#   Connectivity check
+#       ping() used to download the whole IBM Quantum landing page, with no timeout, at the
+#       start of every run. HealthCheck keeps one requests.Session (so the connection is kept
+#       alive between checks), sends HEAD requests with hard connect and read timeouts, and
+#       remembers the answer for ttl seconds. Once started, a background thread checks again
+#       every ttl/2 seconds, so status() in the main loop just returns the latest answer;
+#       only when that is too old (the server stopped answering) does status() wait for a
+#       check, and then never longer than the timeouts. 0 means the server couldn't be reached.
+#       (The status messages come from the old ping, based on pi-ping by Wesley Archer
+#       (raspberrycoulis) (c) 2017, https://github.com/raspberrycoulis/Pi-Ping)
 #----------------------------------------------------------------------------
-def ping(website='https://quantum.cloud.ibm.com/',repeats=1,wait=0.5,verbose=False):
-  msg = 'ping response'
-  for n in range(repeats):
-    response = requests.get(website)
-    if int(response.status_code) == 200: # OK
-        pass
-    elif int(response.status_code) == 500: # Internal server error
-        msg ='Internal server error'
-    elif int(response.status_code) == 503: # Service unavailable
-        msg = 'Service unavailable'
-    elif int(response.status_code) == 502: # Bad gateway
-        msg = 'Bad gateway'
-    elif int(response.status_code) == 520: # Cloudflare: Unknown error
-        msg = 'Cloudflare: Unknown error'
-    elif int(response.status_code) == 522: # Cloudflare: Connection timed out
-        msg = 'Cloudflare: Connection timed out'
-    elif int(response.status_code) == 523: # Cloudflare: Origin is unreachable
-        msg = 'Cloudflare: Origin is unreachable'
-    elif int(response.status_code) == 524: # Cloudflare: A Timeout occurred
-        msg = 'Cloudflare: A Timeout occurred'
-    if verbose: print(response.status_code,msg)
-    if repeats>1: sleep(wait)
-    
-  return int(response.status_code)
+SERVER_MESSAGES = {0: 'No response', 200: 'ping response', 500: 'Internal server error',
+                   502: 'Bad gateway', 503: 'Service unavailable', 520: 'Cloudflare: Unknown error',
+                   522: 'Cloudflare: Connection timed out', 523: 'Cloudflare: Origin is unreachable',
+                   524: 'Cloudflare: A Timeout occurred'}
+
+class HealthCheck():
+    def __init__(self, url, ttl=30, timeout=(3.05, 5)):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout      # (connect, read) seconds
+        self.session = None
+        self.checking = Lock()      # one check at a time; anyone else waits for its answer
+        self.code = None
+        self.checked = None         # monotonic time of the last answer
+        self.error = None
+        self.checks = 0
+        self.failures = 0
+        self.stopping = Event()
+
+    def check(self):
+        import requests                       # only needed when there is a server to reach
+        with self.checking:
+            if self.session is None: self.session = requests.Session()
+            try:
+                response = self.session.head(self.url, timeout=self.timeout, allow_redirects=True)
+                if response.status_code == 405:     # no HEAD here: GET, but don't read the page
+                    response = self.session.get(self.url, timeout=self.timeout, stream=True)
+                    response.close()
+                code, self.error = response.status_code, None
+            except requests.RequestException as e:
+                code, self.error = 0, e
+            self.checks += 1
+            if code != 200: self.failures += 1
+            self.code, self.checked = code, monotonic()
+            return code
+
+    def fresh(self):
+        return self.checked is not None and monotonic() - self.checked < self.ttl
+
+    def status(self, verbose=False):
+        if not self.fresh():
+            seen = self.checked
+            with self.checking: pass            # a check under way answers for us
+            if self.checked == seen or not self.fresh(): self.check()
+        if verbose: print(self.code, SERVER_MESSAGES.get(self.code, ''), self.error or '')
+        return self.code
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.check()
+            self.stopping.wait(self.ttl / 2)
+
+    def start(self):
+        Thread(target=self.run, name="health check", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def stats(self):
+        return {'checks': self.checks, 'failures': self.failures}
+
+health_check = None
+health_check_lock = Lock()
+
+def connectivity():
+    # the one health checker, started the first time anything asks
+    global health_check, ping_url
+    with health_check_lock:
+        if health_check is None:
+            if PingFaux is not None:
+                from ping_faux import FauxServer
+                ping_url = FauxServer(status=PingFaux).start().url
+                print("checking connectivity against the ping_faux stand-in at", ping_url)
+            health_check = HealthCheck(ping_url, ping_ttl).start()
+    return health_check
 # end DEF ----------------------------------------------------------------
 
+#----------------------------------------------------------------------------
+#   Parsed-circuit cache
+#       Parsing a big generated QASM file takes a while on a Pi, and it is the same file start
+#       after start. load_circuit() parses it once and keeps the circuit as QPY in
+#       ./cache/circuits, named by the SHA-256 of the QASM text, so a changed file is simply a
+#       new entry. A JSON sidecar next to it holds the qubit count and register names, which
+#       circuit_metadata() reads without qiskit at all (None for a file not seen before).
+#----------------------------------------------------------------------------
+def qasm_key(qasm):
+    return hashlib.sha256(qasm.encode()).hexdigest()[:32]
+
+def circuit_cache_file(qasm, extension):
+    return os.path.join(cache_folder, 'circuits', qasm_key(qasm) + extension)
+
+def circuit_metadata(qasm):
+    if not UseDiskCache: return None
+    try:
+        with open(circuit_cache_file(qasm, '.json')) as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_circuit(qasm):
+    qpy_file_name = circuit_cache_file(qasm, '.qpy')
+    metadata = circuit_metadata(qasm)
+    if metadata is not None and metadata.get('qiskit') == IBMQVersion and os.path.isfile(qpy_file_name):
+        try:
+            with open(qpy_file_name, 'rb') as qpy_file:
+                circuit = qpy.load(qpy_file)[0]
+            print("loaded parsed circuit from", qpy_file_name)
+            return circuit
+        except Exception as e:
+            print("could not load cached circuit, parsing again:", e)
+    circuit = QuantumCircuit.from_qasm_str(qasm)
+    if UseDiskCache:
+        try:
+            os.makedirs(os.path.dirname(qpy_file_name), exist_ok=True)
+            with open(qpy_file_name + '.tmp', 'wb') as qpy_file:
+                qpy.dump(circuit, qpy_file)
+            os.replace(qpy_file_name + '.tmp', qpy_file_name)
+            write_atomic(circuit_cache_file(qasm, '.json'), json.dumps({
+                'num_qubits': circuit.num_qubits, 'num_clbits': circuit.num_clbits,
+                'qregs': [[r.name, r.size] for r in circuit.qregs],
+                'cregs': [[r.name, r.size] for r in circuit.cregs],
+                'qiskit': IBMQVersion}))
+        except Exception as e:
+            print("could not save parsed circuit:", e)
+    return circuit
+
+#----------------------------------------------------------------------------
+#   Transpile cache
+#       The same circuit runs on the same backend every iteration, so the transpiled circuit is
+#       kept in memory and saved as QPY in ./cache/transpiled. The key covers the circuit, the
+#       backend name and version, a fingerprint of its target, the optimization level and the
+#       Qiskit version, so only the first run (or the first start after any of those change)
+#       pays for transpiling.
+#----------------------------------------------------------------------------
+transpiled_circuits = {}
+samplers = {}           # id(backend) -> (backend, sampler)
+
+def circuit_hash(circuit):
+    buffer = io.BytesIO()
+    qpy.dump(circuit, buffer)
+    return hashlib.sha256(buffer.getvalue()).hexdigest()
+
+def target_fingerprint(backend):
+    try:
+        target = backend.target
+    except AttributeError:
+        return 'no-target'
+    parts = [str(target.num_qubits)]
+    for name in sorted(target.operation_names):
+        qargs = target.qargs_for_operation_name(name)
+        parts.append(name + ':' + (str(sorted(qargs)) if qargs else '*'))
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:16]
+
+def transpile_key(circuit, backend, optimization_level):
+    key = '|'.join([circuit_hash(circuit), str(backend.name), str(getattr(backend, 'backend_version', backend.version)),
+                    target_fingerprint(backend), str(optimization_level), IBMQVersion])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def transpiled_circuit(circuit, backend, optimization_level=1):
+    key = transpile_key(circuit, backend, optimization_level)
+    if key in transpiled_circuits:
+        return transpiled_circuits[key]
+    cache_file = os.path.join(cache_folder, 'transpiled', key + '.qpy')
+    if UseDiskCache and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as qpy_file:
+                transpiled_circuits[key] = qpy.load(qpy_file)[0]
+            print("loaded transpiled circuit from", cache_file)
+            return transpiled_circuits[key]
+        except Exception as e:
+            print("could not load cached transpiled circuit, transpiling again:", e)
+    pm = generate_preset_pass_manager(backend=backend, optimization_level=optimization_level)
+    transpiled_circuits[key] = pm.run(circuit)    # two steps sets us up to use SamplerV2
+    if UseDiskCache:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file + '.tmp', 'wb') as qpy_file:
+                qpy.dump(transpiled_circuits[key], qpy_file)
+            os.replace(cache_file + '.tmp', cache_file)
+        except Exception as e:
+            print("could not save transpiled circuit:", e)
+    return transpiled_circuits[key]
+
+#----------------------------------------------------------------------------
+#   Job watcher
+#       Waits for a job by polling its status on a schedule instead of in a tight loop:
+#       every 0.05 s for a local simulator, and for a remote job starting at 2 s and doubling
+#       up to a minute while it sits in the queue. A job RUNNING for longer than stall_timeout
+#       (remote jobs), or unfinished after cancel_timeout, is cancelled. Every poll is handed
+#       to the status callback as callback(job, status, seconds_waited).
+#----------------------------------------------------------------------------
+class JobWatcher():
+    FINAL = ('DONE', 'CANCELLED', 'ERROR')
+
+    def __init__(self, job, remote=False, callback=None, stall_timeout=None, cancel_timeout=None):
+        self.job = job
+        self.callback = callback
+        self.stall_timeout = stall_timeout
+        self.cancel_timeout = cancel_timeout
+        if remote: self.first_interval, self.max_interval, self.backoff = 2.0, 60.0, 2.0
+        else:      self.first_interval, self.max_interval, self.backoff = 0.05, 0.05, 1.0
+        self.polls = 0
+
+    def status(self):
+        self.polls += 1
+        status = self.job.status()
+        return getattr(status, 'name', str(status)).upper()     # JobStatus enum (local) or string (runtime)
+
+    def wait(self):
+        # returns 'done', 'error', 'cancelled' (at the backend), 'stalled' or 'timeout'
+        start = monotonic()
+        running_since = None
+        interval = self.first_interval
+        last_status = None
+        while True:
+            status = self.status()
+            now = monotonic()
+            if self.callback: self.callback(self.job, status, now - start)
+            if status in self.FINAL:
+                return status.lower()
+            if status != last_status:
+                interval = self.first_interval      # something moved: look again soon
+                last_status = status
+            if status == 'RUNNING':
+                if running_since is None: running_since = now
+                if self.stall_timeout and now - running_since > self.stall_timeout:
+                    self.job.cancel()
+                    return 'stalled'
+            if self.cancel_timeout and now - start > self.cancel_timeout:
+                self.job.cancel()
+                return 'timeout'
+            # don't sleep past a deadline
+            deadlines = [interval]
+            if self.cancel_timeout: deadlines.append(start + self.cancel_timeout - now)
+            if self.stall_timeout and running_since is not None: deadlines.append(running_since + self.stall_timeout - now)
+            sleep(max(0.0, min(deadlines)) + 0.01)
+            interval = min(interval * self.backoff, self.max_interval)
+
+def faux_job(qjob):
+    # pretend this is a job on a busy remote backend
+    from job_faux import FauxJob
+    if JobFaux == 'stall':    return FauxJob(qjob, queue_time=5, stall=True)
+    elif JobFaux == 'cancel': return FauxJob(qjob, queue_time=5, cancel=True)
+    else:                     return FauxJob(qjob, queue_time=float(JobFaux))
+
+#----------------------------------------------------------------------------
+#   Backend status cache
+#       Every backend.status() is a round trip to IBM Quantum, and one run used to ask up to
+#       five times, plus once per job status poll. backend_status.status(backend) hands back
+#       the answer fetched within the last ttl seconds instead; when it is older, one caller
+#       fetches a new one and anyone asking meanwhile waits for that answer rather than making
+#       their own call. Hits and misses are counted (shown at the end, and with -debug).
+#----------------------------------------------------------------------------
+class BackendStatusCache():
+    def __init__(self, ttl=15):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = {}           # backend name -> (status, monotonic time fetched)
+        self.refreshing = {}        # backend name -> Lock held while its status is fetched
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, name):
+        # the entry if it is fresh enough (called with self.lock held)
+        entry = self.entries.get(name)
+        if entry is not None and monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        return None
+
+    def status(self, backend):
+        name = backend.name
+        with self.lock:
+            status = self.cached(name)
+            if status is not None: return status
+            refresh = self.refreshing.setdefault(name, Lock())
+        with refresh:
+            with self.lock:
+                status = self.cached(name)      # fetched while we waited our turn
+                if status is not None: return status
+                self.misses += 1
+            status = backend.status()
+            with self.lock:
+                self.entries[name] = (status, monotonic())
+            return status
+
+    def invalidate(self, backend=None):
+        with self.lock:
+            if backend is None: self.entries.clear()
+            else: self.entries.pop(backend.name, None)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+backend_status = BackendStatusCache(status_ttl)
+
+def report_job_status(job, status, waited):
+    if not UseLocal or JobFaux:
+        print(f"{waited:6.1f}s", job.job_id(), "status:", status, "| queued jobs:", backend_status.status(job.backend()).pending_jobs)
+    elif debug:
+        print(f"{waited:6.1f}s", job.job_id(), "status:", status)
+
+#----------------------------------------------------------------------------
+#   Run scheduler
+#       Decides when the next run starts. The main loop blocks in wait_next() on an Event with
+#       a timeout, so it uses no CPU while idle; joystick events arrive through the SenseHat's
+#       direction_any callback and wake it early. Two modes:
+#           fixed delay (default): the next run starts interval seconds after this one finished
+#           fixed rate (-fixedrate): runs start every interval seconds, however long each one took
+#----------------------------------------------------------------------------
+class RunScheduler():
+    def __init__(self, interval, fixed_rate=False):
+        self.interval = interval
+        self.fixed_rate = fixed_rate
+        self.wake = Event()
+        self.request = None         # 'go' (joystick tapped) or 'stop' (joystick held to the side)
+        self.run_starts = []        # monotonic time each run started, for the cadence report
+
+    def run_started(self):
+        self.run_starts.append(monotonic())
+        del self.run_starts[:-20]   # the cadence is averaged over the last few runs
+
+    def stick_event(self, event):
+        # called from the SenseHat joystick thread
+        if event.action == 'pressed':                                   # somebody tapped the joystick -- go now
+            self.request = self.request or 'go'
+        elif event.action == 'held' and event.direction == 'middle':   # held down: shut the Pi down
+            display_state.publish(shutdown=True)
+            return
+        elif event.action == 'held':                                    # held to a side: stop looping
+            self.request = 'stop'
+        else:
+            return
+        self.wake.set()
+
+    def wait_next(self):
+        # returns 'timer', 'go' or 'stop'
+        if self.fixed_rate and self.run_starts: deadline = self.run_starts[-1] + self.interval
+        else:                                   deadline = monotonic() + self.interval
+        while self.request is None:
+            remaining = deadline - monotonic()
+            if remaining <= 0: return 'timer'
+            self.wake.wait(remaining)
+            self.wake.clear()
+        reason, self.request = self.request, None
+        return reason
+
+    def run_now(self):
+        # start the next run without waiting out the interval
+        self.request = self.request or 'go'
+        self.wake.set()
+
+    def cadence(self):
+        # average seconds between run starts, or None before the second run
+        if len(self.run_starts) < 2: return None
+        return (self.run_starts[-1] - self.run_starts[0]) / (len(self.run_starts) - 1)
+
+#----------------------------------------------------------------------------
+#   QASM file watcher (-watch)
+#       Polls the QASM file's modification time in the background. A change is only reported
+#       once the time has held still for a poll, so a file still being saved isn't read half
+#       written. The main loop calls take() between runs and reloads the circuit if it says so;
+#       on_change (the run scheduler's run_now) starts that run without waiting out the interval.
+#----------------------------------------------------------------------------
+class FileWatcher():
+    def __init__(self, path, on_change=None, period=1.0):
+        self.path = path
+        self.on_change = on_change
+        self.period = period
+        self.mtime = self.modified()
+        self.changed = Event()
+        self.stopping = Event()
+
+    def modified(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None             # missing for now (some editors save by replacing the file)
+
+    def run(self):
+        pending = None
+        while not self.stopping.wait(self.period):
+            mtime = self.modified()
+            if mtime is None or mtime == self.mtime: continue
+            if mtime != pending:
+                pending = mtime     # still changing: look again next poll
+                continue
+            self.mtime, pending = mtime, None
+            self.changed.set()
+            if self.on_change: self.on_change()
+
+    def start(self):
+        Thread(target=self.run, name="file watcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def take(self):
+        # True once per change
+        if not self.changed.is_set(): return False
+        self.changed.clear()
+        return True
+
+file_watcher = None
+
+#----------------------------------------------------------------------------
+#   Playlist (-playlist:path)
+#       For exhibitions: one process cycles through several circuits. path is a folder (every
+#       .qasm file in it, in name order) or a playlist file naming one QASM file per line,
+#       optionally followed by a weight; blank lines and # comments are skipped, and relative
+#       paths start from the playlist file's folder. Entries take turns by smooth weighted
+#       round robin -- with weights 3 and 1 the first plays three times as often, spread out
+#       (a a b a a a b a ...) -- so equal weights are plain round robin.
+#       Each entry's circuit, engine (on its own copy of a local Aer simulator, so each keeps
+#       its own method), transpiled circuit, sampler and display layout are built once at
+#       startup; use_entry() just swaps them in. With -batch or -prefetch each entry keeps its
+#       own queue of results while the others play.
+#----------------------------------------------------------------------------
+class PlaylistEntry():
+    def __init__(self, path, weight=1.0):
+        self.path = path
+        self.weight = weight
+        self.name = os.path.basename(path)
+        with open(path) as f: self.qasm = f.read()
+        self.circuit = None         # these are filled in by prepare_quantum() and Step 7
+        self.engine = None
+        self.display = None
+        self.pattern = None         # all-zero pattern for the layout
+        self.queue = None           # the entry's PatternQueue while another entry plays
+        self.runs = 0               # runs it has had, reported at exit
+
+    def __str__(self):
+        return f"{self.name} ({self.circuit.num_qubits} qubits, {self.engine.name} engine, weight {self.weight:g})"
+
+class Playlist():
+    def __init__(self, entries):
+        self.entries = entries
+        self.credit = [0.0] * len(entries)
+
+    def next(self):
+        # smooth weighted round robin: everyone earns their weight, the richest plays and pays the total
+        total = sum(entry.weight for entry in self.entries)
+        for i, entry in enumerate(self.entries): self.credit[i] += entry.weight
+        best = max(range(len(self.entries)), key=lambda i: self.credit[i])
+        self.credit[best] -= total
+        return self.entries[best]
+
+def read_playlist(path):
+    entries = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.qasm'): entries.append(PlaylistEntry(os.path.join(path, name)))
+    else:
+        folder = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if not line: continue
+                parts = line.rsplit(None, 1)
+                try:
+                    file_name, weight = parts[0], float(parts[1])
+                except (IndexError, ValueError):
+                    file_name, weight = line, 1.0       # no weight (or a file name with a space in it)
+                if weight > 0: entries.append(PlaylistEntry(os.path.join(folder, file_name), weight))
+    if not entries: raise ValueError("no QASM files in playlist " + path)
+    return Playlist(entries)
+
+playlist = None
+playing = None      # the PlaylistEntry now on the display
+
+def use_entry(entry):
+    # switch to another playlist entry: everything it needs was built at startup. Nothing is
+    # published, so the last result stays on the display until the new entry has its own
+    global qasmfilename, qasm, qcirc, qubits_needed, engine, display, maxpattern, qubitpattern, pattern_queue, playing
+    if entry is playing: return
+    if playing is not None: playing.queue = pattern_queue
+    qasmfilename, qasm, qcirc, engine = entry.path, entry.qasm, entry.circuit, entry.engine
+    qubits_needed = entry.circuit.num_qubits
+    display, maxpattern = entry.display, entry.pattern
+    qubitpattern = maxpattern
+    pattern_queue = entry.queue
+    playing = entry
+    print("playlist:", entry)
+
+#----------------------------------------------------------------------------
+#   Shot-by-shot playback (-shots[:fps])
+#       Instead of only the most frequent pattern, every shot of a job is shown in turn.
+#       The per-shot bit strings come straight from the result's BitArray, whose .array is
+#       packed bits (one row of bytes per shot); np.unpackbits() turns them into one row of
+#       0/1 per shot in the same order as the get_counts() keys, and the layout renders all
+#       of them in one step. The display thread then cycles through the frames at fps.
+#----------------------------------------------------------------------------
+class ShotPlayback():
+    def __init__(self, bit_array, layout, measured_qubits, fps=10):
+        shots = np.unpackbits(bit_array.array, axis=1)[:, -bit_array.num_bits:]
+        self.frames = layout.render(layout.shot_bits(shots), measured_qubits)
+        self.labels = [row.tobytes().decode('ascii') for row in shots + ord('0')]
+        self.frame_time = 1.0 / fps
+
+    def __len__(self):
+        return len(self.frames)
+
+def shot_playback(pub_result, creg_name, layout, width):
+    # layout and width are the circuit's own, not whatever is current when the result arrives
+    if not ShotFps: return None
+    return ShotPlayback(getattr(pub_result.data, creg_name), layout, width, ShotFps)
+
+#----------------------------------------------------------------------------
+#   Batched runs (-batch:K)
+#       One sampler job carries K copies of the circuit (K PUBs of num_shots each), and the
+#       max pattern of each PUB goes into a queue. The main loop takes one pattern per
+#       iteration, so the job overhead (and a remote queue wait) is paid once per K displays.
+#       When the queue runs down to low_water the next batch is submitted from a background
+#       thread, so it is normally full again before the loop gets to the end of it.
+#       On a real backend (refill=False) only one batch is run, like the single job before --
+#       and one that fails isn't resubmitted either.
+#
+#   Prefetch (-prefetch:N)
+#       The same queue with a depth: the background thread keeps running jobs (batches of one,
+#       or of K with -batch) until N results are waiting, and starts again as soon as one is
+#       taken. The local simulator works while the display shows the last pattern, and the main
+#       loop only pops and shows, so a joystick press gets a new pattern right away.
+#----------------------------------------------------------------------------
+class PatternQueue():
+    def __init__(self, engine, circuit, batch_size, shots, layout, width, refill=True, low_water=None, depth=None):
+        self.engine = engine
+        self.circuit = circuit
+        self.layout = layout            # the display layout and qubit count the circuit's shots are played on
+        self.width = width
+        self.batch_size = batch_size
+        self.shots = shots
+        self.refill = refill
+        self.depth = batch_size if depth is None else max(depth, batch_size)   # most patterns to hold
+        self.low_water = max(1, batch_size // 4) if low_water is None else low_water
+        self.patterns = deque()         # (pattern, count, shots) waiting to be displayed; shots is a ShotPlayback or None
+        self.changed = Condition()
+        self.filling = False
+        self.batches = 0                # batches that came back with results
+        self.failures = 0               # batches that didn't
+
+    def run_batch(self):
+        qjob = self.engine.sampler.run([self.circuit] * self.batch_size, shots=self.shots)
+        if JobFaux: qjob = faux_job(qjob)
+        print("batch of", self.batch_size, "submitted, JobID:", qjob.job_id())
+        remote_job = not UseLocal or bool(JobFaux)
+        watcher = JobWatcher(qjob, remote_job, report_job_status,
+                             stall_timeout=stalled_time if remote_job else None,
+                             cancel_timeout=job_timeout)
+        outcome = watcher.wait()
+        print("Batch job", qjob.job_id(), outcome, "after", watcher.polls, "status checks")
+        if outcome != 'done': return []
+        creg_name = self.circuit.cregs[0].name
+        patterns = []
+        for pub_result in qjob.result():
+            counts = getattr(pub_result.data, creg_name).get_counts()
+            pattern = max(counts, key=counts.get)
+            patterns.append((pattern, counts[pattern], shot_playback(pub_result, creg_name, self.layout, self.width)))
+        return patterns
+
+    def fill(self):
+        # run batches until there is no room for another one (or one fails)
+        while True:
+            try:
+                patterns = self.run_batch()
+            except Exception as e:
+                print("batch job failed:", e)
+                patterns = []
+            with self.changed:
+                self.patterns.extend(patterns)
+                if patterns: self.batches += 1
+                else: self.failures += 1
+                if not patterns or not self.refill or len(self.patterns) + self.batch_size > self.depth:
+                    self.filling = False
+                self.changed.notify_all()
+                if not self.filling: return
+
+    def start_fill(self):
+        # call with self.changed held
+        if self.filling or not (self.refill or self.first_batch_due()): return
+        self.filling = True
+        Thread(target=self.fill, name="batch refill", daemon=True).start()
+
+    def first_batch_due(self):
+        # without refill, one batch is tried, and not tried again if it fails
+        return self.batches == 0 and self.failures == 0
+
+    def ready(self):
+        with self.changed:
+            return len(self.patterns) > 0
+
+    def close(self):
+        # no more batches (the circuit changed); one already running just finishes
+        with self.changed:
+            self.refill = False
+
+    def more(self):
+        # is there anything left to show, now or after a refill?
+        with self.changed:
+            return len(self.patterns) > 0 or self.filling or self.refill or self.first_batch_due()
+
+    def get(self):
+        # the next (pattern, count, shots), waiting for a batch if the queue is empty; None if the batch failed
+        with self.changed:
+            if len(self.patterns) <= self.low_water: self.start_fill()
+            while not self.patterns and self.filling:
+                self.changed.wait()
+            if not self.patterns: return None
+            item = self.patterns.popleft()
+            if len(self.patterns) <= self.low_water: self.start_fill()
+            return item
+
+pattern_queue = None
+
+# one SamplerV2 per backend, reused from iteration to iteration (local backends skip qiskit_ibm_runtime)
+def get_sampler(backend):
+    if id(backend) not in samplers:
+        if UseLocal:
+            sampler = BackendSamplerV2(backend=backend)   # what runtime's SamplerV2 runs in local mode anyway
+        else:
+            import_runtime()
+            sampler = SamplerV2(mode=backend)
+        samplers[id(backend)] = (backend, sampler)      # (the backend is kept so its id isn't reused)
+    return samplers[id(backend)][1]
+
+#----------------------------------------------------------------------------
+#   Circuit analyzer and simulation engines
+#       The bundled circuits are a layer of Hadamards and a measurement: every qubit is
+#       independent, so a full simulation is wasted on them. analyze_circuit() looks at
+#       what the circuit actually does, and choose_engine() routes it:
+#           numpy       product-state circuits (one-qubit gates only, measurements at the end):
+#                       each qubit's chance of reading 1 is worked out once, and the shots are
+#                       drawn as one array of random numbers
+#           stabilizer  Clifford-only circuits, on Aer's stabilizer method
+#           aer         everything else, on the backend built by StartQuantumService()
+#       Only a noiseless local AerSimulator is rerouted; noisy simulators and real backends
+#       always run the circuit themselves.
+#----------------------------------------------------------------------------
+CLIFFORD_GATES = {'id', 'x', 'y', 'z', 'h', 's', 'sdg', 'sx', 'sxdg',
+                  'cx', 'cy', 'cz', 'swap', 'iswap', 'ecr', 'dcx'}
+NON_GATES = {'barrier', 'measure'}
+
+class CircuitProfile():
+    def __init__(self, circuit):
+        self.num_qubits = circuit.num_qubits
+        self.depth = circuit.depth()
+        self.gates = set(circuit.count_ops()) - NON_GATES
+        self.gate_count = sum(n for name, n in circuit.count_ops().items() if name not in NON_GATES)
+        self.clifford = self.gates <= CLIFFORD_GATES
+        self.one_qubit_probs = product_state_probabilities(circuit)   # None unless a product state
+        self.product_state = self.one_qubit_probs is not None
+        self.bond_exponent = bond_exponent(circuit)
+        self.kind = 'product state' if self.product_state else 'Clifford' if self.clifford else 'general'
+
+    def __str__(self):
+        return f"{self.num_qubits} qubits, depth {self.depth}, {self.kind}, gates: {' '.join(sorted(self.gates))}"
+
+def analyze_circuit(circuit):
+    return CircuitProfile(circuit)
+
+def bond_exponent(circuit):
+    # entanglement structure: log2 of the largest bond dimension a matrix product state could
+    # need, from how many multi-qubit gates cross each cut between neighbouring qubits
+    n = circuit.num_qubits
+    crossings = np.zeros(max(n - 1, 0), dtype=int)
+    for instruction in circuit.data:
+        if instruction.operation.name in NON_GATES or len(instruction.qubits) < 2: continue
+        qubits = [circuit.find_bit(q).index for q in instruction.qubits]
+        crossings[min(qubits):max(qubits)] += 1
+    if n < 2: return 0
+    return int(max(min(crossings[i], i + 1, n - i - 1) for i in range(n - 1)))
+
+def product_state_probabilities(circuit):
+    # for a circuit of one-qubit gates with measurements only at the end, the chance each
+    # classical bit reads 1 (as {clbit index: probability}); otherwise None
+    unitaries = [np.eye(2, dtype=complex) for q in range(circuit.num_qubits)]
+    measured = {}                         # qubit index -> clbit index
+    for instruction in circuit.data:
+        operation = instruction.operation
+        qubits = [circuit.find_bit(q).index for q in instruction.qubits]
+        if operation.name == 'barrier':
+            continue
+        if any(q in measured for q in qubits):
+            return None                   # something happens after a measurement
+        if getattr(operation, 'condition', None) is not None or len(qubits) != 1:
+            return None                   # classically controlled, or entangling
+        if operation.name == 'measure':
+            measured[qubits[0]] = circuit.find_bit(instruction.clbits[0]).index
+            continue
+        try:
+            unitaries[qubits[0]] = Operator(operation).data @ unitaries[qubits[0]]
+        except Exception:
+            return None                   # reset, delay, unbound parameter...
+    return {clbit: float(abs(unitaries[q][1, 0]) ** 2) for q, clbit in measured.items()}
+
+class FinishedJob():
+    # the product-state sampler finishes inside run(), so its job is done from the start
+    count = 0
+
+    def __init__(self, result):
+        FinishedJob.count += 1
+        self._job_id = f"numpy-{FinishedJob.count}"
+        self._result = result
+
+    def job_id(self):           return self._job_id
+    def status(self):           return JobStatus.DONE
+    def done(self):             return True
+    def in_final_state(self):   return True
+    def cancelled(self):        return False
+    def cancel(self):           return False
+    def result(self):           return self._result
+
+class ProductStateSampler():
+    # takes the same run([circuit, ...], shots=n) call as SamplerV2 and returns the same
+    # result shape (a BitArray per classical register), for product-state circuits only
+    def __init__(self):
+        self.rng = np.random.default_rng()
+        self.plans = {}         # id(circuit) -> (circuit, clbit probabilities)
+
+    def sample(self, circuit, shots):
+        if id(circuit) not in self.plans:
+            self.plans[id(circuit)] = (circuit, product_state_probabilities(circuit))
+        probabilities = self.plans[id(circuit)][1]
+        p_one = np.zeros(circuit.num_clbits)
+        for clbit, p in probabilities.items(): p_one[clbit] = p
+        ones = self.rng.random((shots, circuit.num_clbits)) < p_one
+        registers = {}
+        for creg in circuit.cregs:
+            columns = [circuit.find_bit(bit).index for bit in creg]
+            registers[creg.name] = BitArray.from_bool_array(ones[:, columns], order='little')
+        return SamplerPubResult(DataBin(**registers), metadata={'shots': shots})
+
+    def run(self, pubs, shots=1024):
+        circuits = [pub[0] if isinstance(pub, tuple) else pub for pub in pubs]
+        return FinishedJob(PrimitiveResult([self.sample(circuit, shots) for circuit in circuits],
+                                           metadata={'version': 2}))
+
+class SimulationEngine():
+    def __init__(self, name, backend=None, reason=''):
+        self.name = name
+        self.backend = backend      # None for the NumPy product-state sampler
+        self.reason = reason
+        self.numpy_sampler = ProductStateSampler() if backend is None else None
+        self.worker = None          # an AerWorker that runs this engine's jobs instead (-worker)
+
+    def prepare(self, circuit):
+        # the circuit this engine runs: transpiled for an Aer backend, as it is for NumPy
+        if self.backend is None: return circuit
+        if self.worker is not None: return self.worker.prepare(circuit, self.backend)   # transpiled over there
+        return transpiled_circuit(circuit, self.backend, 1)
+
+    @property
+    def sampler(self):
+        if self.backend is None: return self.numpy_sampler
+        if self.worker is not None: return self.worker
+        return get_sampler(self.backend)
+
+    def __str__(self):
+        return f"{self.name} ({self.reason})" if self.reason else self.name
+
+#----------------------------------------------------------------------------
+#   Aer method selection
+#       A circuit that stays on an AerSimulator gets the simulation method expected to be
+#       fastest for it on this host. Calibration runs a ladder circuit (a layer of ry rotations
+#       and a chain of cx gates, repeated) with each method the backend could use, at the
+#       calibration widths up to the first one past the circuit's, and keeps the timings in
+#       ./cache/aer_profile.json, per host and Aer version; a later, wider circuit only times
+#       the widths still missing. With -nocache the timings couldn't be kept, so instead of
+#       calibrating on every start, heuristic_aer_method() guesses from the circuit alone.
+#       The estimate for a circuit scales the calibrated time at its width, less the fixed cost
+#       of any run:
+#           statevector and density_matrix by gate count (memory decides if they fit at all)
+#           matrix_product_state by gate count and by the bond dimension its entanglement allows
+#       With a noise model, statevector and MPS re-simulate every shot, while density_matrix
+#       runs once, so only then is density_matrix a candidate.
+#       These are rough estimates -- they only have to put the methods in the right order.
+#----------------------------------------------------------------------------
+AER_METHODS = ('statevector', 'matrix_product_state', 'density_matrix')
+CALIBRATION_WIDTHS = {'statevector': (4, 8, 12, 16, 20),
+                      'matrix_product_state': (4, 8, 12, 16, 20),
+                      'density_matrix': (2, 4, 6, 8, 10)}
+CALIBRATION_LAYERS = 4
+CALIBRATION_TIME_LIMIT = 2.0    # seconds: a method this slow at some width isn't timed any wider
+AMPLITUDE_BYTES = 16    # one complex128
+growth = {'statevector': lambda n: 2.0 ** n,            # how the work grows past the calibrated widths
+          'density_matrix': lambda n: 4.0 ** n,
+          'matrix_product_state': lambda n: float(n)}
+
+def calibration_circuit(width, layers=CALIBRATION_LAYERS):
+    circuit = QuantumCircuit(width)
+    for layer in range(layers):
+        for q in range(width): circuit.ry(0.1 + 0.3 * q + layer, q)
+        for q in range(width - 1): circuit.cx(q, q + 1)
+    circuit.measure_all()
+    return circuit
+
+def calibration_widths(method, width):
+    # the calibration widths needed to estimate a circuit this wide: up to the first at or past it
+    widths = []
+    for w in CALIBRATION_WIDTHS[method]:
+        widths.append(w)
+        if w >= width: break
+    return widths
+
+def calibrate_aer_methods(needed, time_limit=CALIBRATION_TIME_LIMIT):
+    # seconds for one single-shot run of the calibration circuit, for each method and its widths in needed
+    timings = {}
+    for method, widths in needed.items():
+        simulator = AerSimulator(method=method)
+        timings[method] = {}
+        for width in widths:
+            circuit = calibration_circuit(width)
+            best = None
+            for repeat in range(2):
+                start = monotonic()
+                simulator.run(circuit, shots=1).result()
+                elapsed = monotonic() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[method][str(width)] = best
+            print(f"   calibrating {method:22} {width:3} qubits: {best * 1000:8.2f} ms")
+            if best > time_limit: break     # wider would only take longer
+    return timings
+
+def aer_profile_key():
+    import qiskit_aer
+    return platform.node() + '|qiskit-aer ' + qiskit_aer.__version__
+
+def missing_widths(timings, method, widths):
+    # the widths not timed yet, leaving out any past a width that was already too slow
+    have = timings.get(method, {})
+    return [w for w in widths if str(w) not in have
+            and not any(int(v) < w and t > CALIBRATION_TIME_LIMIT for v, t in have.items())]
+
+def load_aer_profile(needed):
+    # the calibration timings for this host, timing whatever methods and widths in needed are missing
+    profile_file = os.path.join(cache_folder, 'aer_profile.json')
+    profiles = {}
+    if os.path.isfile(profile_file):
+        try:
+            with open(profile_file) as f: profiles = json.load(f)
+        except (OSError, ValueError) as e:
+            print("could not read", profile_file, e)
+    key = aer_profile_key()
+    timings = {} if Recalibrate else profiles.get(key, {})
+    missing = {method: missing_widths(timings, method, widths) for method, widths in needed.items()}
+    missing = {method: widths for method, widths in missing.items() if widths}
+    if not missing:
+        return timings
+    print("calibrating Aer simulation methods on this host (only done once for each width)...")
+    for method, measured in calibrate_aer_methods(missing).items():
+        timings.setdefault(method, {}).update(measured)
+    profiles[key] = timings
+    if UseDiskCache:
+        try:
+            os.makedirs(cache_folder, exist_ok=True)
+            write_atomic(profile_file, json.dumps(profiles, indent=1))
+        except OSError as e:
+            print("could not save", profile_file, e)
+    return profiles[key]
+
+def calibrated_time(timings, method, width):
+    # calibrated seconds at this width: interpolated between measured widths, grown past them
+    points = sorted((int(w), t) for w, t in timings[method].items())
+    widths = [w for w, t in points]
+    if width <= widths[0]: return points[0][1]
+    if width >= widths[-1]:
+        w, t = points[-1]
+        return t * growth[method](width) / growth[method](w)
+    log_times = np.log([t for w, t in points])
+    return float(np.exp(np.interp(width, widths, log_times)))
+
+def estimate_method_cost(profile, method, timings, shots, noisy):
+    n = profile.num_qubits
+    import psutil
+    if method == 'statevector' and AMPLITUDE_BYTES * 2.0 ** n > psutil.virtual_memory().available / 2: return None
+    if method == 'density_matrix' and (not noisy or AMPLITUDE_BYTES * 4.0 ** n > psutil.virtual_memory().available / 2): return None
+    bench = calibration_circuit(max(n, 2))
+    bench_gates = sum(c for name, c in bench.count_ops().items() if name not in NON_GATES)
+    overhead = min(timings[method].values())        # what even the smallest run costs
+    scale = max(profile.gate_count, 1) / bench_gates
+    if method == 'matrix_product_state':
+        scale *= 8.0 ** (min(profile.bond_exponent, 12) - min(bond_exponent(bench), 12))   # chi^3 per gate
+    cost = overhead + max(calibrated_time(timings, method, n) - overhead, 0.0) * scale
+    if noisy and method != 'density_matrix':
+        cost *= shots           # every shot is a separate trajectory
+    return cost
+
+def heuristic_aer_method(profile, noisy):
+    # a guess without calibration timings: small noisy circuits suit density_matrix, and
+    # MPS wins when entanglement stays low or the state vector wouldn't fit in memory
+    import psutil
+    n = profile.num_qubits
+    if noisy and n <= 10: return 'density_matrix'
+    if profile.bond_exponent <= 4 or AMPLITUDE_BYTES * 2.0 ** n > psutil.virtual_memory().available / 2:
+        return 'matrix_product_state'
+    return 'statevector'
+
+def select_aer_method(profile, backend, shots):
+    noisy = backend.options.noise_model is not None
+    candidates = [method for method in AER_METHODS if noisy or method != 'density_matrix']
+    if not UseDiskCache:
+        method = heuristic_aer_method(profile, noisy)
+        print("-nocache: no calibration profile to keep, so guessing", method)
+        return method
+    timings = load_aer_profile({method: calibration_widths(method, profile.num_qubits) for method in candidates})
+    costs = {}
+    for method in candidates:
+        cost = estimate_method_cost(profile, method, timings, shots, noisy)
+        if cost is not None: costs[method] = cost
+    print("estimated run time by method:", ", ".join(f"{m} {c * 1000:.1f} ms" for m, c in costs.items()))
+    return min(costs, key=costs.get)
+
+#----------------------------------------------------------------------------
+#   Aer parallelism tuning (-tune)
+#       Left alone, Aer spreads over every core, which fights the display thread on a 4-core
+#       Pi for little gain on circuits this small. apply_aer_tuning() gives each local Aer
+#       simulator the settings -tune found best for this host, circuit width, simulation method
+#       and kind of circuit (kept in ./cache/aer_tuning.json; what suits the stabilizer method
+#       says little about statevector), or otherwise just keeps one core free for the display.
+#       -tune times every combination of max_parallel_threads, max_parallel_shots and (with
+#       -batch) max_parallel_experiments on the real circuit and shot count; when settings are
+#       within 5% of the best, the one using fewer threads wins.
+#----------------------------------------------------------------------------
+def usable_cores():
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, cores - 1)        # one core stays with the display thread
+
+def tuning_file():
+    return os.path.join(cache_folder, 'aer_tuning.json')
+
+def load_aer_tunings():
+    if os.path.isfile(tuning_file()):
+        try:
+            with open(tuning_file()) as f: return json.load(f)
+        except (OSError, ValueError) as e:
+            print("could not read", tuning_file(), e)
+    return {}
+
+def tuning_key(simulator, width, kind):
+    return f"{width} {simulator.options.method} {kind}"
+
+def apply_aer_tuning(simulator, width, kind='general'):
+    settings = load_aer_tunings().get(aer_profile_key(), {}).get(tuning_key(simulator, width, kind))
+    if settings:
+        options = {name: value for name, value in settings.items() if name.startswith('max_parallel')}
+        print("applying tuned Aer settings for", tuning_key(simulator, width, kind), "circuits:", options)
+        simulator.set_options(**options)
+    else:
+        simulator.set_options(max_parallel_threads=usable_cores())
+
+def tune_aer(simulator, circuit, shots, experiments=1, kind='general'):
+    cores = usable_cores()
+    circuits = [circuit] * max(experiments, 1)
+    candidates = []
+    for threads in sorted({1, max(1, cores // 2), cores}):
+        for parallel_shots in sorted({1, threads}):
+            for parallel_experiments in sorted({1, min(threads, len(circuits))}):
+                candidates.append({'max_parallel_threads': threads, 'max_parallel_shots': parallel_shots,
+                                   'max_parallel_experiments': parallel_experiments})
+    print("tuning Aer on", cores, "cores:", len(candidates), "settings,", len(circuits), "x", shots, "shots each")
+    results = []
+    for settings in candidates:
+        simulator.set_options(**settings)
+        simulator.run(circuits, shots=shots).result()       # warm up
+        best = None
+        for repeat in range(3):
+            start = monotonic()
+            simulator.run(circuits, shots=shots).result()
+            elapsed = monotonic() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"   threads {settings['max_parallel_threads']:2} shots {settings['max_parallel_shots']:2}"
+              f" experiments {settings['max_parallel_experiments']:2}: {best * 1000:8.2f} ms")
+        results.append((best, settings))
+    fastest = min(best for best, settings in results)
+    best, chosen = min((r for r in results if r[0] <= fastest * 1.05),
+                       key=lambda r: (r[1]['max_parallel_threads'], r[0]))
+    simulator.set_options(**chosen)
+    tunings = load_aer_tunings()
+    tunings.setdefault(aer_profile_key(), {})[tuning_key(simulator, circuit.num_qubits, kind)] = dict(chosen, seconds=best)
+    if UseDiskCache:
+        try:
+            os.makedirs(cache_folder, exist_ok=True)
+            write_atomic(tuning_file(), json.dumps(tunings, indent=1))
+        except OSError as e:
+            print("could not save", tuning_file(), e)
+    print("best Aer settings:", chosen, f"({best * 1000:.2f} ms)")
+    return chosen
+
+#----------------------------------------------------------------------------
+#   Backend snapshot cache
+#       Building a noise-modelled simulator ('aermodel', 'aernoise') means connecting to IBM,
+#       finding the least busy backend and building a noise model from it: many seconds, and
+#       impossible offline. The first time, the backend's target, properties and noise model
+#       are saved in ./cache/snapshots/<backend name>.pickle, with a JSON sidecar holding its
+#       qubit count, when it was saved and the qiskit and qiskit-aer versions that saved it.
+#       After that the simulator is rebuilt from the freshest snapshot with no network at all --
+#       as long as the sidecar's versions match the installed ones and the backend has enough
+#       qubits; otherwise it is built from the real backend again, and that snapshot is saved.
+#       A snapshot older than snapshot_ttl is still used, but a fresh one is fetched in the
+#       background for the next start.
+#----------------------------------------------------------------------------
+def snapshot_backend(snapshot):
+    # just enough of a backend for AerSimulator.from_backend(): the saved target
+    # (defined in here because BackendV2 is only imported along with qiskit)
+    from qiskit.providers import BackendV2, Options
+
+    class SnapshotBackend(BackendV2):
+        def __init__(self, snapshot):
+            super().__init__(name=snapshot['name'], backend_version=snapshot['backend_version'])
+            self._target = snapshot['target']
+
+        @property
+        def target(self):
+            return self._target
+
+        @property
+        def max_circuits(self):
+            return None
+
+        @classmethod
+        def _default_options(cls):
+            return Options()
+
+        def run(self, run_input, **options):
+            raise NotImplementedError("a backend snapshot can only be used to build a simulator")
+
+    return SnapshotBackend(snapshot)
+
+def snapshot_file(name, extension):
+    return os.path.join(cache_folder, 'snapshots', name + extension)
+
+def snapshot_versions():
+    # what has to match for a pickled target and noise model to be trusted
+    import qiskit_aer
+    return {'qiskit': IBMQVersion, 'qiskit_aer': qiskit_aer.__version__}
+
+def save_backend_snapshot(backend):
+    try:
+        properties = backend.properties()
+        properties = properties.to_dict() if properties is not None else None
+    except Exception:
+        properties = None
+    snapshot = {'name': backend.name, 'backend_version': backend.backend_version, 'saved': wall_clock(),
+                'target': backend.target, 'properties': properties,
+                'noise_model': NoiseModel.from_backend(backend)}
+    if UseDiskCache:
+        pickle_file = snapshot_file(backend.name, '.pickle')
+        try:
+            os.makedirs(os.path.dirname(pickle_file), exist_ok=True)
+            with open(pickle_file + '.tmp', 'wb') as f:
+                pickle.dump(snapshot, f)
+            os.replace(pickle_file + '.tmp', pickle_file)
+            write_atomic(snapshot_file(backend.name, '.json'), json.dumps(dict(
+                name=backend.name, num_qubits=backend.num_qubits, saved=snapshot['saved'], **snapshot_versions())))
+        except OSError as e:
+            print("could not save the backend snapshot:", e)
+    return snapshot
+
+def load_backend_snapshot(num_qubits):
+    # the freshest snapshot saved by these library versions of a backend with enough qubits (or None)
+    folder = os.path.dirname(snapshot_file('', ''))
+    if not UseDiskCache or not os.path.isdir(folder): return None
+    versions = snapshot_versions()
+    usable = []
+    for file_name in os.listdir(folder):
+        if not file_name.endswith('.json'): continue
+        try:
+            with open(os.path.join(folder, file_name)) as f: metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if any(metadata.get(library) != version for library, version in versions.items()):
+            print("backend snapshot of", metadata.get('name'), "was saved with other qiskit versions; not used")
+        elif metadata.get('num_qubits', 0) < num_qubits:
+            print("backend snapshot of", metadata.get('name'), "has only", metadata.get('num_qubits'), "qubits; not used")
+        else:
+            usable.append(metadata)
+    for metadata in sorted(usable, key=lambda m: m['saved'], reverse=True):
+        try:
+            with open(snapshot_file(metadata['name'], '.pickle'), 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print("could not load the backend snapshot of", metadata['name'], e)
+    return None
+
+def snapshot_simulator(snapshot, n_qubits):
+    options = {'n_qubits': n_qubits}
+    if not snapshot['noise_model'].is_ideal(): options['noise_model'] = snapshot['noise_model']
+    return AerSimulator.from_backend(snapshot_backend(snapshot), **options)
+
+def refresh_backend_snapshot():
+    # runs in the background: the new snapshot is used from the next start
+    try:
+        import_runtime()
+        real_backend = QiskitRuntimeService().least_busy(simulator=False)
+        save_backend_snapshot(real_backend)
+        print("backend snapshot refreshed from", real_backend.name)
+    except Exception as e:
+        print("could not refresh the backend snapshot (will try again next start):", e)
+
+def reroutable(backend):
+    # only a noiseless local Aer simulator can hand its circuits to another engine
+    return is_aer(backend) and backend.options.noise_model is None
+
+def choose_engine(circuit, backend, choice='auto'):
+    default = SimulationEngine('aer', backend, backend.name)
+    if choice == 'aer' or not UseLocal or not is_aer(backend):
+        return default
+    profile = analyze_circuit(circuit)
+    print("circuit analysis:", profile)
+    if reroutable(backend):
+        if profile.product_state and choice in ('auto', 'numpy'):
+            return SimulationEngine('numpy', None, 'product state: qubits sampled independently')
+        if profile.clifford and choice in ('auto', 'stabilizer'):
+            stabilizer = AerSimulator(method='stabilizer')
+            apply_aer_tuning(stabilizer, circuit.num_qubits, profile.kind)
+            return SimulationEngine('stabilizer', stabilizer, 'Clifford circuit')
+    if choice in AER_METHODS:
+        backend.set_options(method=choice)
+        apply_aer_tuning(backend, circuit.num_qubits, profile.kind)
+        return SimulationEngine(choice, backend, 'requested with -sim')
+    if choice != 'auto': print("the", choice, "engine can't run this circuit; choosing a method for", backend.name)
+    method = select_aer_method(profile, backend, num_shots)
+    backend.set_options(method=method)
+    apply_aer_tuning(backend, circuit.num_qubits, profile.kind)     # tuned for this method and kind of circuit
+    reason = 'fastest estimate from the calibration profile' if UseDiskCache else 'guessed without calibrating (-nocache)'
+    return SimulationEngine(method, backend, reason)
+
+#----------------------------------------------------------------------------
+#   Worker process (-worker)
+#       The display thread shares the GIL with everything else in this process, so the rainbow
+#       stutters while a job is transpiled, run and read back. With -worker, a local Aer
+#       engine's transpiling and sampling move to aer_worker.py, started as a separate process
+#       on every core but the first; this process (the display thread and the main loop) is
+#       kept to the first. The simulator is pickled over once, each circuit once (and
+#       transpiled over there right away), and after that a run is a few bytes each way.
+#       AerWorker.run() takes the same run(pubs, shots=n) call as SamplerV2 and returns a job
+#       that the reply thread completes; the frame jitter in glow.stats() shows the difference.
+#----------------------------------------------------------------------------
+class WorkerJob():
+    # a job running in the worker process
+    def __init__(self, job_id):
+        self._job_id = job_id
+        self.finished = Event()
+        self._result = None
+        self.error = None
+
+    def job_id(self):           return self._job_id
+    def done(self):             return self.status() == JobStatus.DONE
+    def in_final_state(self):   return self.finished.is_set()
+    def cancelled(self):        return False
+    def cancel(self):           return False
+
+    def status(self):
+        if not self.finished.is_set(): return JobStatus.RUNNING
+        return JobStatus.ERROR if self.error else JobStatus.DONE
+
+    def result(self):
+        self.finished.wait()
+        if self.error: raise RuntimeError("worker job failed: " + self.error)
+        return self._result
+
+def worker_result(pubs, metadata):
+    # rebuild the PrimitiveResult from the packed bits the worker sent back
+    return PrimitiveResult([SamplerPubResult(DataBin(**{name: BitArray(array, num_bits)
+                                                        for name, (array, num_bits) in pub.items()}))
+                            for pub in pubs], metadata=metadata)
+
+class AerWorker():
+    def __init__(self, cores):
+        import subprocess
+        from aer_worker import read_message, write_message
+        self.read_message, self.write_message = read_message, write_message
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aer_worker.py')
+        self.process = subprocess.Popen([sys.executable, script, ','.join(str(c) for c in cores)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        ready = read_message(self.process.stdout)
+        if ready is None: raise RuntimeError("the worker process didn't start")
+        self.pid, self.cores = ready[1], ready[2]
+        self.sending = Lock()
+        self.jobs = {}              # job id -> WorkerJob still running
+        self.count = 0
+        self.backends = {}          # id(backend) -> (key, backend)
+        self.circuits = {}          # id(circuit) -> (key, circuit)
+        Thread(target=self.read_replies, name="worker replies", daemon=True).start()
+
+    def send(self, *message):
+        with self.sending:
+            self.write_message(self.process.stdin, message)
+
+    def prepare(self, circuit, backend):
+        # hand the backend and circuit over (once each); the circuit is transpiled over there
+        if id(backend) not in self.backends:
+            self.backends[id(backend)] = (len(self.backends), backend)
+            self.send('backend', self.backends[id(backend)][0], backend)
+        if id(circuit) not in self.circuits:
+            self.circuits[id(circuit)] = (len(self.circuits), circuit)
+            self.send('circuit', self.circuits[id(circuit)][0], self.backends[id(backend)][0], circuit)
+        return circuit
+
+    def run(self, pubs, shots=1024):
+        circuits = [pub[0] if isinstance(pub, tuple) else pub for pub in pubs]
+        if any(circuit is not circuits[0] for circuit in circuits):
+            raise ValueError("the worker runs copies of one circuit per job")
+        with self.sending:
+            self.count += 1
+            job = WorkerJob(f"worker-{self.count}")
+            self.jobs[job.job_id()] = job
+            self.write_message(self.process.stdin, ('run', job.job_id(), self.circuits[id(circuits[0])][0], len(circuits), shots))
+        return job
+
+    def read_replies(self):
+        while True:
+            try:
+                message = self.read_message(self.process.stdout)
+            except Exception as e:
+                print("worker reply unreadable:", e)
+                message = None
+            if message is None: break
+            job = self.jobs.pop(message[1], None)
+            if job is None: continue
+            if message[0] == 'result': job._result = worker_result(message[2], message[3])
+            else: job.error = message[2]
+            job.finished.set()
+        for job in list(self.jobs.values()):      # the worker is gone: nothing else is coming back
+            job.error = "the worker process ended"
+            job.finished.set()
+
+    def stop(self):
+        try:
+            self.send('stop')
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+
+    def __str__(self):
+        return f"worker process {self.pid} on cores {self.cores}"
+
+aer_worker = None
+display_cores = []      # cores this process is kept to once the worker has the others
+
+def start_worker(engine):
+    # move the engine's jobs to a worker process; this process keeps the first core for the display
+    # (pinned by pin_process() on the main thread, as this may run on a startup pool thread)
+    global aer_worker, display_cores
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = []
+    worker_cores = cores[1:] if len(cores) > 1 else cores
+    engine.worker = aer_worker = AerWorker(worker_cores)
+    print("simulation runs in", engine.worker)
+    if len(cores) > 1:
+        display_cores = cores[:1]
+    else:
+        print("only one core: the worker can't be kept off the display's core, but no longer shares its GIL")
+
+def pin_process(cores):
+    # on Linux sched_setaffinity(0, ...) pins only the calling thread, so pin every thread this
+    # process has now; threads started later take the mask of the thread that starts them
+    try:
+        threads = [int(task) for task in os.listdir('/proc/self/task')]
+    except OSError:
+        threads = [0]
+    for thread_id in threads:
+        try:
+            os.sched_setaffinity(thread_id, cores)
+        except OSError:
+            pass            # a thread that finished in the meantime
+    print("display and main loop kept to core", ', '.join(str(core) for core in cores))
+
 
 
 
@@ -735,6 +2538,7 @@ def StartQuantumService():
     if debug:     input("Press Enter Key to create backend")
     
     #A whole bunch of logic to see if we need to connect to a quantum service or just spin up an Aer simulator
+    if UseLocal or 'aer' in backendparm: import_aer()     # every local simulator is built on Aer
     
     if qubits_needed > 5 and UseLocal: 
         if 'mod' in backendparm or 'nois' in backendparm:
@@ -742,7 +2546,6 @@ def StartQuantumService():
             backendparm = 'aer_model'
         else:   #basic aer simulator does not need to connect to provider
             UseLocal = True
-            from qiskit_aer import AerSimulator
             print("creating basic Aer Simulator")
             Q = AerSimulator(method='matrix_product_state')    
     elif not UseLocal and 'aer' in backendparm:
@@ -751,16 +2554,25 @@ def StartQuantumService():
             backendparm = 'aer_model'
         else:   #basic aer simulator does not need to connect to provider
             UseLocal = True
-            from qiskit_aer import AerSimulator
             print("creating basic Aer Simulator")
-            Q = AerSimulator(method='matrix_product_state')    
-            
-    if not UseLocal:
-            
-        print ('Pinging IBM Quantum API server before start')
-        p=ping('https://quantum.cloud.ibm.com',1,0.5,True)
-        #p=ping('https://auth.quantum-computing.ibm.com/api',1,0.5,True)
-        #p=ping('https://quantum-computing.ibm.com/',1,0.5,True)
+            Q = AerSimulator(method='matrix_product_state')
+
+    snapshot = None
+    if not UseLocal and "aer" in backendparm and ("model" in backendparm or "nois" in backendparm or AddNoise) and qubits_needed<28:
+        snapshot = load_backend_snapshot(qubits_needed)     # a noise-modelled simulator can be rebuilt offline
+    if snapshot is not None:
+        age = wall_clock() - snapshot['saved']
+        print("creating AerSimulator modeled from", snapshot['name'], f"(snapshot {age / 3600:.1f} hours old)")
+        Q = snapshot_simulator(snapshot, qubits_needed)
+        backend = 'snapshot of ' + snapshot['name']
+        UseLocal = True
+        if age > snapshot_ttl:
+            print("backend snapshot is stale; refreshing it in the background")
+            Thread(target=refresh_backend_snapshot, name="snapshot refresh", daemon=True).start()
+    elif not UseLocal:
+        import_runtime()
+        print ('Checking the IBM Quantum API server before start')
+        p=connectivity().status(verbose=True)
         try:
             print("requested backend: ",backendparm)
         except:
@@ -823,12 +2635,11 @@ def StartQuantumService():
                 
                 #-- If we've made it here we have successfully created our runtimeservice!
                 if "aer" in backendparm:
-                    from qiskit_aer import AerSimulator
                     if ("model" in backendparm or "nois" in backendparm or AddNoise) and qubits_needed<28:
                         print("getting a real backend connection for aer model")
                         real_backend = Qservice.least_busy(simulator=False)#operational=True, backend("ibm_brisbane")
                         print("creating AerSimulator modeled from ",real_backend.name)
-                        Q = AerSimulator.from_backend(real_backend,n_qubits=qubits_needed)
+                        Q = snapshot_simulator(save_backend_snapshot(real_backend), qubits_needed)   # and keep it for next time
                     else:
                         print("creating basic Aer Simulator")
                         Q = AerSimulator(n_qubits=qubits_needed)    
@@ -853,10 +2664,11 @@ def StartQuantumService():
         backend='local aer qasm_simulator'
         print ("Building ",backend, "with requested attributes...")
         if not AddNoise:
-            from qiskit_aer import AerSimulator
             Q = AerSimulator(n_qubits=qubits_needed)  #Aer.get_backend('qasm_simulator')
         else:
-            Q = FakeManilaV2() 
+            import_runtime()
+            Q = FakeManilaV2()
+    if is_aer(Q): apply_aer_tuning(Q, qubits_needed)     # tuned settings, or one core kept for the display
 #-------------------------------------------------------------------------------
 
 ###########################################################################################
@@ -866,6 +2678,7 @@ def StartQuantumService():
 ############################################################################################
     
 #------------------------ Step 1: Process input arguments -----------------------------------
+arguments_phase = StartupPhase("arguments").begin()
 
 # -- prompt for any extra arguments if specified
 print(sys.argv)
@@ -1041,8 +2854,27 @@ if (len(sys.argv)>1):
 				# If new output devices are added this needs to be expanded and showqubits updated to handle it
             if '-e' in parameter: UseEmulator = True       # force use of the SenseHat emulator even if hardware is installed
             if '-faux' in parameter: UseFaux = True
+            if parameter == '-web': web_port = 8080    # built-in web view on the default port
+            if '-fixedrate' in parameter: FixedRate = True     # runs start every interval seconds
+            if '-calibrate' in parameter: Recalibrate = True   # benchmark the Aer methods again
+            if '-tune' in parameter: Tune = True               # find the best Aer thread settings for this circuit
+            if '-serial' in parameter: SerialStartup = True    # no parallel startup (to compare startup times)
+            if parameter == '-shots': ShotFps = 10             # play back every shot, 10 a second
+            if parameter == '-prefetch': Prefetch = 3          # keep 3 local results ready ahead of the display
+            if '-worker' in parameter: UseWorker = True        # run Aer jobs in a separate, core-pinned process
+            if '-watch' in parameter: WatchFile = True         # pick up changes to the QASM file as it runs
+            if parameter == '-jobfaux': JobFaux = '5'          # local jobs act like remote ones queued for 5 s
+            if '-pingfaux' in parameter:                        # check connectivity against a local stand-in server
+                PingLocal = True
+                if PingFaux is None: PingFaux = 200
+            if '-nocache' in parameter: UseDiskCache = False    # don't read or write ./cache
+            if '-shm' in parameter: svg_folder = '/dev/shm/quantum-raspberry-tie/svg'   # keep the svg files in RAM, off the SD card
             if '-dual' in parameter: DualDisplay = True
             if '-neopixel' in parameter: UseNeo = True  
+            if '-neofaux' in parameter:                  # drive the neopixel_faux stand-in (works off the Pi too)
+                UseNeo = True
+                NeoFaux = True
+            if '-neobench' in parameter: NeoBench = True
             if 'notile' in parameter: NeoTiled = False
             if '-select' in parameter: 
 				# SelectBackend is a special interactive prompt that appears for choosing the backend by name at the last moment during its instantiation
@@ -1051,26 +2883,184 @@ if (len(sys.argv)>1):
             elif ':' in parameter:                         # parse two-component parameters
                 print("processing two part parameter ", parameter)
                 token = parameter.split(':')[0]            # before the colon is the key
-                value = parameter.split(':')[1]            # after the colon is the value
-                if '-b' in token: 
+                value = parameter.split(':', 1)[1]         # after the colon is the value (a url keeps its own colons)
+                if '-batch' in token:
+                    BatchRuns = int(value)      # iterations per sampler job (checked before -b, which it contains)
+                elif '-b' in token: 
                     backendparm = value      # if the key is -b, specify the backend
                     UseLocal = False
                     print("requested backend: ", backendparm, ", UseLocal set ",UseLocal)
+                elif '-webhost' in token:
+                    web_host = value            # address for the web view to listen on
+                elif '-web' in token:
+                    web_port = int(value)       # built-in web view on this port
+                elif '-shots' in token:
+                    ShotFps = float(value)      # shots played back per second
+                elif '-playlist' in token:
+                    PlaylistPath = value        # folder of QASM files, or a playlist file
+                elif '-prefetch' in token:
+                    Prefetch = int(value)       # local results to keep computed ahead
+                    if Prefetch < 1:
+                        print("-prefetch:N needs at least 1 result ahead (leave -prefetch off to run each job when it's due)... exiting.")
+                        exit()
+                elif '-sim' in token:
+                    EngineChoice = value        # auto, numpy, stabilizer, aer, or an Aer method name
+                elif '-snapttl' in token:
+                    snapshot_ttl = float(value) * 3600     # hours before a backend snapshot is refreshed
+                elif '-interval' in token:
+                    interval = float(value)     # seconds between runs
+                elif '-jobfaux' in token:
+                    JobFaux = value             # seconds to sit in the fake queue, or 'stall' or 'cancel'
+                elif '-pingurl' in token:
+                    ping_url = value            # check connectivity against this url instead
+                    PingLocal = True
+                elif '-pingttl' in token:
+                    ping_ttl = float(value)     # seconds a connectivity check is trusted
+                elif '-statusttl' in token:
+                    backend_status.ttl = status_ttl = float(value)   # seconds a backend status is reused
+                elif '-pingfaux' in token:
+                    PingFaux = int(value)       # status code for the stand-in server to answer
+                elif '-jobtimeout' in token:
+                    job_timeout = float(value)  # cancel jobs still unfinished after this many seconds
+                elif '-svgrate' in token:
+                    svg_rate = float(value)     # most svg file writes per second
+                elif '-fps' in token:
+                    frame_rate = float(value)   # rainbow animation frame rate
                 elif '-f' in token:
                     qasmfileinput = value  # if the key is -f, specify the qasm file
                     print("-f option: filename",qasmfileinput)
                     print ("QASM File input",qasmfileinput)
                 elif '-nois' in token: fake_name = value
             if debug: input("press Enter to continue")
-             
+arguments_phase.end()
+
+#-------------------   Startup orchestration
+#       Reading the QASM file, importing qiskit, parsing the circuit, building the backend,
+#       choosing the engine and transpiling for it (Steps 3 and 6 below) don't need the
+#       display, and the display doesn't need them until Step 7 picks the layout. So they
+#       run as one chain in the startup pool while this thread probes the display hardware,
+#       and the logo's "thinking" frames are built alongside them. -serial (and -select or
+#       -debug, which stop for input along the way, or a remote backend with no saved account,
+#       whose credentials are asked for) runs the chain in line instead, on this thread.
+
+def prepare_quantum():
+    global scriptfolder, qasmfilename, qasm, qcirc, qubits_needed, engine, playlist
+
+    # ------------------------- Step 3:  Find the QASM Input file 
+    #
+    # 		find our experiment file... alternate can be specified on command line
+    #       use a couple tricks to make sure it is there
+    #       if not fall back on our default file
+
+    qasm_phase = StartupPhase("read QASM").begin()
+    scriptfolder = os.path.dirname(os.path.realpath("__file__"))
+    if PlaylistPath:                 # a playlist instead: its first entry stands in for the file
+        playlist = read_playlist(PlaylistPath)
+        qasmfilename, qasm = playlist.entries[0].path, playlist.entries[0].qasm
+        print("playlist of", len(playlist.entries), "circuits:", ", ".join(entry.name for entry in playlist.entries))
+    else:
+        if ('16' in  qasmfileinput):    qasmfilename='expt16.qasm' 
+        elif ('12' in qasmfileinput):    qasmfilename='expt12.qasm' 
+        elif ('32' in qasmfileinput):    qasmfilename='expt32.qasm'
+        else: qasmfilename = qasmfileinput
+          #qasmfilename='expt.qasm'
+        print("QASM File:",qasmfilename)
+
+        #complete the path if necessary
+        if ('/' not in qasmfilename):
+          qasmfilename=scriptfolder+"/"+qasmfilename
+        if (not os.path.isfile(qasmfilename)):
+            qasmfilename=scriptfolder+"/"+'expt.qasm'
+            
+        print("OPENQASM file: ",qasmfilename)
+        if (not os.path.isfile(qasmfilename)):
+            print("QASM file not found... exiting.")
+            exit()
+
+        #  Read our input file create the circuit, and confirm how many qubits we need
+        #							if it is more than specified in the command line, adjust!
+         
+        exptfile = open(qasmfilename,'r') # open the file with the OPENQASM code in it
+        qasm= exptfile.read()            # read the contents into our experiment string
+
+        if (len(qasm)<5):                # if that is too short to be real, exit
+            exit
+        else:                            # otherwise print it to the console for reference
+            print("OPENQASM code to send:\n",qasm)
+    qasm_phase.end()
+
+    # ------------------ Step 6. Instantiate our Quantum Service !
+
+    #to determin the number of qubits, we have to make the circuit (or find it in the parsed-circuit cache)
+    metadata = circuit_metadata(qasm)
+    if metadata is not None:
+        print("circuit seen before:", metadata['num_qubits'], "qubits, registers", metadata['cregs'])
+    import_qiskit()
+    with StartupPhase("parse circuit"):
+        qcirc=load_circuit(qasm)                             # parsed once, then loaded as QPY
+        qubits_needed = qcirc.num_qubits
+        if playlist is not None:
+            playlist.entries[0].circuit = qcirc
+            for entry in playlist.entries[1:]: entry.circuit = load_circuit(entry.qasm)
+            qubits_needed = max(entry.circuit.num_qubits for entry in playlist.entries)   # the backend must fit them all
+
+    with StartupPhase("build backend"):
+        StartQuantumService()                                # try to connect and instantiate the IBMQ 
+
+    with StartupPhase("choose engine"):
+        engine = choose_engine(qcirc, Q, EngineChoice)       # how the circuit is actually going to be simulated
+    print("simulation engine:", engine)
+    if Tune:
+        if is_aer(engine.backend): tune_aer(engine.backend, engine.prepare(qcirc), num_shots, BatchRuns, analyze_circuit(qcirc).kind)
+        else: print("-tune only applies to Aer simulators; the", engine.name, "engine has nothing to tune")
+    circuits, engines = [qcirc], [engine]
+    if playlist is not None:
+        with StartupPhase("playlist engines"):
+            playlist.entries[0].engine = engine
+            for entry in playlist.entries[1:]:
+                backend = deepcopy(Q) if is_aer(Q) else Q      # its own simulator, so its own method
+                entry.engine = choose_engine(entry.circuit, backend, EngineChoice)
+        circuits = [entry.circuit for entry in playlist.entries]
+        engines = [entry.engine for entry in playlist.entries]
+    if UseWorker:
+        aer_engines = [e for e in engines if is_aer(e.backend)]
+        if UseLocal and aer_engines:
+            with StartupPhase("start worker"):
+                start_worker(aer_engines[0])
+            for other in aer_engines[1:]: other.worker = aer_worker      # one worker runs them all
+        else: print("-worker only applies to local Aer simulators; the", engine.name, "engine runs in this process")
+    with StartupPhase("pre-transpile"):
+        for circuit, circuit_engine in zip(circuits, engines):
+            circuit_engine.prepare(circuit)                  # transpiled and cached before the first run needs it
+            circuit_engine.sampler                           # and the sampler built
+
+def build_thinking_frames(mask):
+    with StartupPhase("thinking frames"):
+        return rainbow_ring(mask)
+
+def needs_credentials():
+    # a remote backend with no saved IBM Quantum account: StartQuantumService() will prompt for one,
+    # which has to happen on the main thread (checked without importing qiskit_ibm_runtime)
+    remote = not UseLocal and not ('aer' in backendparm and 'mod' not in backendparm and 'nois' not in backendparm)
+    if not remote or os.environ.get('QISKIT_IBM_TOKEN'): return False
+    return not os.path.isfile(os.path.join(os.path.expanduser('~'), '.qiskit', 'qiskit-ibm.json'))
+
+startup_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+if SerialStartup or SelectBackend or debug or needs_credentials():
+    quantum_setup = None                  # prepare_quantum() runs in Step 5 instead
+else:
+    quantum_setup = startup_pool.submit(prepare_quantum)
+if QWhileThinking and not SerialStartup: startup_pool.submit(build_thinking_frames, QKLogo_mask)
+
 #-------------------   Step 2: Check the hardware and disable rPi-only options on non-rPi
+display_phase = StartupPhase("display hardware").begin()
 
 IsRPi = ("aarch64" in platform.processor() or 'aarch64' in platform.machine())
 if not IsRPi:           # if the hardware is not a raspberry pi, the SenseHat and Neopixels are not available
     NoHat = True
     UseEmulator = True
     DualDisplay = False
-    UseNeo  = False
+    UseNeo  = NeoFaux     # only the stand-in can run here
     print("platform.processor():",platform.processor(),"| platform.machine():",platform.machine()," architecture indicates this is not a Raspberry Pi; disabling program modules dependent on pi")
     
 #-------------------   Step 3: Set up SenseHat or alternative for display
@@ -1099,6 +3089,7 @@ if UseEmulator:
             from sense_faux import SenseHat         # class for controlling the faux (no GUI) API is identical to the real SenseHat class
         
         hat = SenseHat() # instantiating hat emulator so we can use it in functions
+        import psutil                          # used to detect sensehat GUI
         while not SenseHatEMU:
             print("waiting for SenseHat emulator to start: iteration ",hatcounter,"/60")
             print("checking for SenseHat EMU GUI")
@@ -1121,11 +3112,14 @@ if UseEmulator:
     except:
         NoHat = True
             
-if UseNeo and IsRPi :
+if UseNeo and (IsRPi or NeoFaux):
     print("importing neopixel library...")
     try:
-        import board
-        import neopixel_spi as neopixel
+        if NeoFaux:
+            import neopixel_faux as neopixel    # pure-Python stand-in, no SPI hardware needed
+        else:
+            import board
+            import neopixel_spi as neopixel
     except Exception as e:
         print("Error importing neopixel library: ", e)
         UseNeo = False
@@ -1140,7 +3134,8 @@ if UseNeo and IsRPi :
         BRIGHTNESS = 0.10
 
         # Neopixel initialization
-        spi = board.SPI()
+        if NeoFaux: spi = None
+        else:       spi = board.SPI()
 
         neopixel_array = neopixel.NeoPixel_SPI(
             spi,
@@ -1172,6 +3167,8 @@ else:
 if UseNeo:
     if NeoTiled:    LED_array_indices = RQ2_array_indices
     else:           LED_array_indices = matrix_map
+    setup_neopixel_map()
+    if NeoBench: neopixel_benchmark()
 
 
 # Initial some more working variables and settings we are going to need 
@@ -1186,88 +3183,46 @@ angle = 180       # Initial display orientation
 result = None
 runcounter=0
 maxpattern='00000'
-interval=5
 stalled_time = 60 # how many seconds we're willing to wait once a job status is "Running"
 
-thinking=False    # used to tell the display thread when to show the result
-shutdown=False    # used to tell the display thread to trigger a shutdown
 qdone=False
-showlogo=False
+# the display thread's thinking/logo/result/shutdown state lives in display_state
 
 # Now call the orient function and show an arrow
 
 if not NoHat and not SenseHatEMU: orient()
 
-display=ibm_qx32    
-if not NoHat: hat.set_pixels(Arrow)
-if UseNeo: 
-    display_to_LEDs(Arrow, LED_array_indices)
-    if DualNEO: display_to_LEDs(Arrow, matrix_map2)
-
-if DualDisplay and not NoHat: hat2.set_pixels(Arrow)
+display=display_layouts['ibm_qx32']
+build_frame_sinks()
+if web_port: start_web_server()
+push_frame(Arrow_frame, pixel_list=Arrow, animation=True)
+first_frame_at = monotonic() - startup_time
+display_phase.end()
 
 
-# ------------------------- Step 3:  Find the QASM Input file 
-#
-# 		find our experiment file... alternate can be specified on command line
-#       use a couple tricks to make sure it is there
-#       if not fall back on our default file
-
-scriptfolder = os.path.dirname(os.path.realpath("__file__"))
-if ('16' in  qasmfileinput):    qasmfilename='expt16.qasm' 
-elif ('12' in qasmfileinput):    qasmfilename='expt12.qasm' 
-elif ('32' in qasmfileinput):    qasmfilename='expt32.qasm'
-else: qasmfilename = qasmfileinput
-  #qasmfilename='expt.qasm'
-print("QASM File:",qasmfilename)
-
-#complete the path if necessary
-if ('/' not in qasmfilename):
-  qasmfilename=scriptfolder+"/"+qasmfilename
-if (not os.path.isfile(qasmfilename)):
-    qasmfilename=scriptfolder+"/"+'expt.qasm'
-    
-print("OPENQASM file: ",qasmfilename)
-if (not os.path.isfile(qasmfilename)):
-    print("QASM file not found... exiting.")
-    exit()
-
-
-# ------------------- Step 4. Instantiate our display thread and our backend
+# ------------------- Step 4. Instantiate our display thread
 
 #        -- (Note that we turned on the display itself earlier; this creates an object we can launch in a parallel thread)
 
 # Instantiate an instance of our glow class
 print("Instantiating glow...")
-glowing = glow()
+glowing = glow(frame_rate)
 # create the html shell file
 write_svg_file(pixels, maxpattern, 2.5, True)
 
 
-# ------------------- Step 5. Read our input file create the circuit, and confirm how many qubits we need
-#							if it is more than specified in the command line, adjust!
- 
-exptfile = open(qasmfilename,'r') # open the file with the OPENQASM code in it
-qasm= exptfile.read()            # read the contents into our experiment string
-
-if (len(qasm)<5):                # if that is too short to be real, exit
-    exit
-else:                            # otherwise print it to the console for reference
-    print("OPENQASM code to send:\n",qasm)
-
-# ------------------ Step 6. Instantiate our Quantum Service !
-
-#to determin the number of qubits, we have to make the circuit
-    
-qcirc=QuantumCircuit.from_qasm_str(qasm)   
-qubits_needed = qcirc.num_qubits
+# ------------------ Step 5. Wait for the circuit, backend and engine from the startup pool
 
+push_frame(QKLogo_frame, pixel_list=QKLogo, animation=True)    # the logo stays up until the backend is ready
 rainbowTie = Thread(target=glowing.run)    			 #  instantiate the display thread
-StartQuantumService()                                # try to connect and instantiate the IBMQ 
-
-qcirc=QuantumCircuit.from_qasm_str(qasm)   
+if quantum_setup is None:
+    prepare_quantum()
+else:
+    with StartupPhase("wait for backend"):
+        quantum_setup.result()                           # (re-raises anything that went wrong over there)
+startup_pool.shutdown(wait=False)
 
-# -------------------- Step 7. draw the circuit on the terminal and adjust the display settings if necessary
+# -------------------- Step 7.draw the circuit on the terminal and adjust the display settings if necessary
 try:
     print("generating circuit from QASM")# (qcirc)
 except UnicodeEncodeError:
@@ -1275,65 +3230,129 @@ except UnicodeEncodeError:
 except:
     print ('Unable to render quantum circuit drawing for some reason')
     
-if qubits_needed >16 or UseQ32:
-    display= ibm_qx32
-    maxpattern='00000000000000000000000000000000'
-    print ("circuit width: ",qubits_needed," using 32 qubit display")
-elif (qubits_needed > 12 and not UseQ32) or UseQ16:
-    display = ibm_qx16
-    maxpattern='0000000000000000'
-    print ("circuit width: ",qubits_needed," using 16 qubit display")
-elif (qubits_needed > 5 and not UseQ16) or UseHex:
-    display = ibm_qhex
-    maxpattern='000000000000'
-    print ("circuit width: ",qubits_needed," using 12 qubit hex display")
-else:
-    if (UseTee and qubits_needed <= 5 ): 
-        display = ibm_qx5t
-        maxpattern='00000'
-    elif (UseHex): 
-        display = ibm_qhex
+def choose_display(qubits_needed):
+    # the display layout for a circuit this wide, and an all-zero pattern that fits it
+    if qubits_needed >16 or UseQ32:
+        display= display_layouts['ibm_qx32']
+        maxpattern='00000000000000000000000000000000'
+        print ("circuit width: ",qubits_needed," using 32 qubit display")
+    elif (qubits_needed > 12 and not UseQ32) or UseQ16:
+        display = display_layouts['ibm_qx16']
+        maxpattern='0000000000000000'
+        print ("circuit width: ",qubits_needed," using 16 qubit display")
+    elif (qubits_needed > 5 and not UseQ16) or UseHex:
+        display = display_layouts['ibm_qhex']
         maxpattern='000000000000'
-    else: 
-        display = ibm_qx5
-        maxpattern='00000'
-    
-    print ("circuit width: ",qubits_needed," using 5 qubit display")
+        print ("circuit width: ",qubits_needed," using 12 qubit hex display")
+    else:
+        if (UseTee and qubits_needed <= 5 ): 
+            display = display_layouts['ibm_qx5t']
+            maxpattern='00000'
+        elif (UseHex): 
+            display = display_layouts['ibm_qhex']
+            maxpattern='000000000000'
+        else: 
+            display = display_layouts['ibm_qx5']
+            maxpattern='00000'
+        
+        print ("circuit width: ",qubits_needed," using 5 qubit display")
+    return display, maxpattern
+
+def reload_circuit():
+    # -watch: the QASM file changed. Everything for the new circuit (parse, engine, transpile,
+    # layout) is built first; only if all of it works is it swapped in, between two runs, while
+    # the display thread carries on. Otherwise the current circuit, its engine, Q and any queued
+    # results are left exactly as they were.
+    global qasm, qcirc, qubits_needed, engine, display, maxpattern, qubitpattern, pattern_queue
+    try:
+        with open(qasmfilename) as f: new_qasm = f.read()
+        if new_qasm == qasm: return False                # touched, not changed
+        new_circuit = load_circuit(new_qasm)
+        backend = deepcopy(Q) if is_aer(Q) else Q        # choose_engine() sets the method on a copy, not on Q
+        new_engine = choose_engine(new_circuit, backend, EngineChoice)
+        if aer_worker is not None and is_aer(new_engine.backend): new_engine.worker = aer_worker
+        new_engine.prepare(new_circuit)                  # transpiled now rather than in the next run
+        new_display, new_pattern = choose_display(new_circuit.num_qubits)
+        if not QWhileThinking: rainbow_ring(new_display)
+    except Exception as e:
+        print("could not load the changed QASM file; keeping the current circuit:", e)
+        return False
+    if pattern_queue is not None:                        # queued results are for the old circuit
+        pattern_queue.close()
+        pattern_queue = None
+    if engine.backend is not None and engine.backend is not Q:
+        samplers.pop(id(engine.backend), None)           # the previous reload's copy isn't needed any more
+    qasm, qcirc, qubits_needed, engine = new_qasm, new_circuit, new_circuit.num_qubits, new_engine
+    display, maxpattern = new_display, new_pattern
+    qubitpattern = maxpattern
+    display_state.publish(pattern=maxpattern, shots=None)
+    print("reloaded", qasmfilename, "|", qubits_needed, "qubits | simulation engine:", engine)
+    return True
+
+display, maxpattern = choose_display(qubits_needed)
 qubitpattern=maxpattern
-
-rainbowTie.start()                          # start the display thread
+if playlist is not None:                  # and every playlist entry's layout
+    for entry in playlist.entries:
+        print(entry.name, end=": ")
+        entry.display, entry.pattern = choose_display(entry.circuit.num_qubits)
+        if not QWhileThinking: rainbow_ring(entry.display)
+    use_entry(playlist.next())
+display_state.publish(pattern=maxpattern)
+
+# build the "thinking" animation frames now so the display thread never has to
+# (the logo's were started in the startup pool, and are only built here if they haven't finished yet)
+if QWhileThinking: rainbow_ring(QKLogo_mask)
+else:              rainbow_ring(display)
+
+if display_cores: pin_process(display_cores)    # -worker: off the worker's cores, before the display thread starts
+rainbowTie.start()                        # start the display thread
+
+run_scheduler = RunScheduler(interval, FixedRate)
+if not NoHat: hat.stick.direction_any = run_scheduler.stick_event     # joystick events now arrive as callbacks
+if WatchFile and playlist is not None:
+    print("-watch only follows a single -f: file; ignored with a playlist")
+elif WatchFile:
+    file_watcher = FileWatcher(qasmfilename, run_scheduler.run_now).start()
+    print("watching", qasmfilename, "for changes")
+ready_at = monotonic() - startup_time     # the startup report is printed once the first result is shown
 
 #---------------------- Step 8: START YOUR ENGINES -- everything is set up, lets run our job (and loop)
 
 while Looping:
    runcounter += 1
+   run_scheduler.run_started()
+   if file_watcher is not None and file_watcher.take(): reload_circuit()    # -watch: the QASM file changed
+   if playlist is not None:
+       if runcounter > 1: use_entry(playlist.next())    # the next circuit's turn
+       playing.runs += 1
    if "aer" in backendparm: UseLocal=True
+   batch_ready = pattern_queue is not None and pattern_queue.ready()   # next pattern is already here: no "thinking"
    try:
-       if not UseLocal:
-           p=ping()
+       if not UseLocal or PingLocal:
+           p=connectivity().status()     # the background check's latest answer
        else:
            p=200
+       if p != 200: print("connection problem with IBMQ:", p, SERVER_MESSAGES.get(p, ''), health_check.error or '')
    except:
        print("connection problem with IBMQ")
    else:
        if p==200:
            orient()
-           showlogo = True
-           thinking = True
+           if not batch_ready: display_state.publish(thinking=True, logo=True)
            Qname=Q.name
            print("Name:",Q.name,"Version:",Q.version,"No. of qubits:",Q.num_qubits)
            if not UseLocal and not "aer" in backendparm: 
-               Qstatus=Q.status()
+               Qstatus=backend_status.status(Q)
                print(Qstatus.backend_name, "is simulator? ", Q.simulator, "| operational: ", Qstatus.operational ,"|  jobs in queue:",Qstatus.pending_jobs)
 
            try:
                if not UseLocal:
-                    Qstatus = Q.status()  # check the availability
+                    Qstatus = backend_status.status(Q)  # check the availability
            except:
                print('Problem getting backend status... waiting to try again')
            else:
                if not UseLocal: 
-                    Qstatus=Q.status()                
+                    Qstatus=backend_status.status(Q)
                     print('Backend Status: ',Qstatus.status_msg, 'operational:',Qstatus.operational)
                     if debug: input('press enter')
                     qstatmsg=Qstatus.status_msg
@@ -1341,7 +3360,28 @@ while Looping:
                else:
                     qstatmsg='active'
                     q_operational=False
-               if (qstatmsg == 'active' and q_operational)  or UseLocal:
+               if (BatchRuns or (Prefetch and UseLocal)) and ((qstatmsg == 'active' and q_operational) or UseLocal):
+                   if pattern_queue is None:
+                       if Prefetch and UseLocal:
+                           print('     prefetching ',Prefetch,' results ahead... on ',Q.name)
+                           pattern_queue = PatternQueue(engine, engine.prepare(qcirc), max(BatchRuns, 1), num_shots,
+                                                        display, qubits_needed, low_water=max(1, Prefetch - 1), depth=Prefetch)
+                       else:
+                           print('     executing batches of ',BatchRuns,' circuits... on ',Q.name)
+                           pattern_queue = PatternQueue(engine, engine.prepare(qcirc), BatchRuns, num_shots,
+                                                        display, qubits_needed, refill=UseLocal or Q.simulator)
+                   display_state.publish(logo=False)
+                   item = pattern_queue.get()
+                   if item is None:
+                       print(backend,' Batch job did not complete.', 'Trying again.' if pattern_queue.refill else 'Not resubmitted to a real backend.')
+                   else:
+                       maxpattern, maxvalue, shots = item
+                       qubitpattern=maxpattern
+                       print("Maximum value:",maxvalue, "Maximum pattern:",maxpattern, "| queued patterns:",len(pattern_queue.patterns))
+                       display_state.publish(thinking=False, pattern=maxpattern, shots=shots)
+                       first_result_shown()
+                   Looping = pattern_queue.more()
+               elif (qstatmsg == 'active' and q_operational)  or UseLocal:
                    
                    print('     executing quantum circuit... on ',Q.name)
                    #print(Q.name,' options:',Q.options)
@@ -1352,22 +3392,21 @@ while Looping:
                    except:
                         print ('Unable to render quantum circuit drawing for some reason')
                    try:
-                        pm = generate_preset_pass_manager(backend=Q, optimization_level=1)
-                        qk1_circ = pm.run(qcirc) # two steps sets us up to use SamplerV2
-                        #qk1_circ=transpile(qcirc, Q) # transpile for the new primitive
+                        qk1_circ = engine.prepare(qcirc)   # only really transpiles the first time
                    except :
                         print("problem transpiling circuit")
                    else:
                         print("transpilation complete")                    
                    #try:
                         if not UseLocal:
-                            print("backend: ",Q.name," operational? ",Q.status().operational," Pending:",Q.status().pending_jobs)
+                            Qstatus=backend_status.status(Q)
+                            print("backend: ",Q.name," operational? ",Qstatus.operational," Pending:",Qstatus.pending_jobs)
                         else:
-                            print("backend: ",Q.name," operational? ALWAYS")
+                            print("backend: ",Q.name," operational? ALWAYS | engine:",engine.name)
                         if debug: input('Press the Enter Key')
                         print("running job with ",num_shots," shots")                       
-                        sampler = SamplerV2(mode=Q)
-                        qjob = sampler.run([qk1_circ], shots=num_shots) #New version uses SamplerV2
+                        qjob = engine.sampler.run([qk1_circ], shots=num_shots) #New version uses SamplerV2 (or the NumPy sampler)
+                        if JobFaux: qjob = faux_job(qjob)     # pretend this is a job on a busy remote backend
                         
                         print("JobID: ",qjob.job_id())
                         print("Job Done?",qjob.done())
@@ -1375,20 +3414,19 @@ while Looping:
                         Looping =  UseLocal or Q.simulator	
                         if runcounter < 3: print("Using ", Qname, " ... Looping is set ", Looping)
                    
-                        running_start = 0
-                        running_timeout = False
-                        running_cancelled = False
-                        showlogo =  False
-                        resuqdone = False
-                        while not (qdone or running_timeout or running_cancelled):
-                            qdone = qjob.in_final_state() or qjob.cancelled()
-                            if not UseLocal:
-                                print(running_start,qjob.job_id(),"Job Done? ", qjob.in_final_state(),"| Cancelled? ",qjob.cancelled(),"| queued jobs:",qjob.backend().status().pending_jobs)
-                            else:
-                                print(running_start,qjob.job_id(),"Job Done? ", qjob.in_final_state(),"| Cancelled? ",qjob.cancelled())
-                            if not qdone: running_start+=1;
-                        
-                        if qjob.done() :
+                        display_state.publish(logo=False)
+                        remote_job = not UseLocal or bool(JobFaux)
+                        watcher = JobWatcher(qjob, remote_job, report_job_status,
+                                             stall_timeout=stalled_time if remote_job else None,
+                                             cancel_timeout=job_timeout)
+                        outcome = watcher.wait()
+                        qdone = (outcome == 'done')
+                        running_timeout = outcome in ('stalled', 'timeout')
+                        running_cancelled = (outcome == 'cancelled')
+                        print("Job", qjob.job_id(), outcome, "after", watcher.polls, "status checks")
+                        if outcome == 'error': print(backend, ' Job failed at backend.')
+
+                        if qdone :
                            # only get here once we get DONE status
                            result = qjob.result()
                            creg_name = qcirc.cregs[0].name              # e.g., 'c' for all built-in QASM files
@@ -1399,30 +3437,30 @@ while Looping:
                            print("Maximum value:",maxvalue, "Maximum pattern:",maxpattern)
                            if UseLocal:
                                sleep(3)
-                           thinking = False  # this cues the display thread to show the qubits in maxpattern
+                           display_state.publish(thinking=False, pattern=maxpattern,   # this cues the display thread to show the qubits in maxpattern
+                                                 shots=shot_playback(result[0], creg_name, display, qubits_needed)) # (or to play back every shot, with -shots)
+                           first_result_shown()
+                        # Looping is still UseLocal or Q.simulator: a job on a real backend is never resubmitted
                         if running_timeout :
-                            print(backend,' Queue appears to have stalled. Restarting Job.')
+                            print(backend,' Queue appears to have stalled.', 'Restarting Job.' if Looping else 'Not resubmitted to a real backend.')
                         if running_cancelled :
-                            print(backend,' Job cancelled at backend. Restarting.')    
-                   
-   goAgain=False                    # wait to do it again
-   if Looping: print('Iteration ',runcounter,' complete; Waiting ',interval,'s before next run...')
-   
-   myTimer=process_time()
-   while not goAgain:
-      if not NoHat:
-          for event in hat.stick.get_events():   
-             if event.action == 'pressed':      #somebody tapped the joystick -- go now
-                goAgain=True
-                blinky(.001)
-                hat.set_pixels(pixels)
-                if DualDisplay: hat2.set_pixels(pixels)
-             if event.action == 'held' and event.direction =='middle':
-                shutdown=True 
-             if event.action == 'held' and event.direction !='middle':
-                 Looping = False
-                 break
-      if (process_time()-myTimer>interval):       # 10 seconds elapsed -- go now
-            goAgain=True
-
+                            print(backend,' Job cancelled at backend.', 'Restarting.' if Looping else 'Not resubmitted to a real backend.')
+
+   # wait to do it again
+   if Looping:
+       cadence = run_scheduler.cadence()
+       print('Iteration ',runcounter,' complete; Waiting ',interval,'s before next run...',
+             '' if cadence is None else f'(one run every {cadence:.1f}s)')
+   if debug: print("Frames:", frame_stats(), "| display thread:", glowing.stats(), "| backend status cache:", backend_status.stats())
+
+   if run_scheduler.wait_next() == 'stop':     # joystick held to the side
+       Looping = False
+
+print("Frames:", frame_stats(), "| display thread:", glowing.stats())
+if NeoFaux and UseNeo: print("NeoPixel stand-in:", neopixel_array.stats())
+if health_check is not None: print("Connectivity checks:", health_check.stats())
+if playlist is not None: print("Playlist runs:", ", ".join(f"{entry.name} {entry.runs}" for entry in playlist.entries))
+if backend_status.hits or backend_status.misses: print("Backend status cache:", backend_status.stats())
+glowing.stop()
+if aer_worker is not None: aer_worker.stop()
 print("Program Execution ended normally")
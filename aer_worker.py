@@ -0,0 +1,96 @@
+#----------------------------------------------------------------------
+#     aer_worker.py
+#       runs Aer transpiling and sampling in a separate process, pinned to its own CPU cores
+#
+#   Started by QuantumRaspberryTie with the -worker option. In one process, the display thread
+#   shares the GIL with transpiling, result handling and the Python side of every Aer call, and
+#   the rainbow stutters while jobs run. Here that work happens in a process of its own, kept
+#   off the display's core with os.sched_setaffinity.
+#
+#   The two processes talk over this process's stdin and stdout: each message is a pickled
+#   tuple behind a 4-byte length. (Anything the worker prints goes to stderr.)
+#       ('backend', key, simulator)                  keep this AerSimulator as backend key
+#       ('circuit', key, backend key, circuit)       transpile this circuit for that backend now
+#       ('run', job id, circuit key, copies, shots)  sample copies of a circuit, shots each
+#       ('stop',)
+#   and it answers
+#       ('ready', pid, cores)
+#       ('result', job id, [ {register: (packed bits, num_bits)} per copy ], metadata)
+#       ('error', job id, message)
+#   PrimitiveResults don't survive pickling, so the packed BitArray data is sent instead.
+#
+#   Usage: python aer_worker.py [comma-separated cores]
+#----------------------------------------------------------------------
+
+import os
+import sys
+import pickle
+import struct
+
+
+def read_message(stream):
+    header = stream.read(4)
+    if len(header) < 4: return None
+    size = struct.unpack('>I', header)[0]
+    return pickle.loads(stream.read(size))
+
+
+def write_message(stream, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(struct.pack('>I', len(data)) + data)
+    stream.flush()
+
+
+def pin(cores):
+    # keep to these cores; returns the cores actually in use
+    if cores and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            print("aer_worker: could not set CPU affinity:", e, file=sys.stderr)
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return []
+
+
+def main():
+    requests, replies = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr             # keep stray prints out of the reply stream
+    cores = {int(c) for c in sys.argv[1].split(',')} if len(sys.argv) > 1 and sys.argv[1] else set()
+    cores = pin(cores)
+
+    from qiskit.primitives import BackendSamplerV2
+    from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+
+    backends = {}       # key -> (simulator, sampler)
+    circuits = {}       # key -> (transpiled circuit, sampler)
+    write_message(replies, ('ready', os.getpid(), cores))
+    while True:
+        message = read_message(requests)
+        if message is None or message[0] == 'stop': break
+        kind = message[0]
+        try:
+            if kind == 'backend':
+                key, simulator = message[1:]
+                backends[key] = (simulator, BackendSamplerV2(backend=simulator))
+            elif kind == 'circuit':
+                key, backend_key, circuit = message[1:]
+                simulator, sampler = backends[backend_key]
+                pass_manager = generate_preset_pass_manager(optimization_level=1, backend=simulator)
+                circuits[key] = (pass_manager.run(circuit), sampler)
+            elif kind == 'run':
+                job_id, key, copies, shots = message[1:]
+                circuit, sampler = circuits[key]
+                result = sampler.run([circuit] * copies, shots=shots).result()
+                pubs = []
+                for pub_result in result:
+                    pubs.append({name: (bits.array, bits.num_bits) for name, bits in pub_result.data.items()})
+                write_message(replies, ('result', job_id, pubs, dict(result.metadata)))
+        except Exception as e:
+            if kind == 'run': write_message(replies, ('error', message[1], repr(e)))
+            else: print("aer_worker:", kind, "failed:", repr(e), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#----------------------------------------------------------------------
+#     job_faux.py
+#       a stand-in for a remote IBM Quantum job, for exercising the job watcher without an account
+#
+#   Used by QuantumRaspberryTie with the -jobfaux option. FauxJob wraps the job returned by a
+#   local simulator and makes it behave like a job on a busy real backend: it reports QUEUED for
+#   queue_time seconds, then RUNNING, and then the wrapped job's own status. It can also be told
+#   to stall (stay RUNNING forever) or to be cancelled at the "backend" once it leaves the queue.
+#
+#   Every status query is counted, so the cost of waiting for a job can be checked.
+#----------------------------------------------------------------------
+
+from collections import namedtuple
+from time import monotonic
+
+FauxBackendStatus = namedtuple('FauxBackendStatus', ('backend_name', 'operational', 'pending_jobs', 'status_msg'))
+
+
+class FauxBackend():
+    def __init__(self, name='faux_backend', pending_jobs=3):
+        self.name = name
+        self.pending_jobs = pending_jobs
+        self.status_calls = 0
+
+    def status(self):
+        self.status_calls += 1
+        return FauxBackendStatus(self.name, True, self.pending_jobs, 'active')
+
+
+class FauxJob():
+    def __init__(self, job=None, queue_time=5.0, run_time=1.0, stall=False, cancel=False, backend=None):
+        self._job = job                 # the real (local) job whose result is handed back
+        self.queue_time = queue_time
+        self.run_time = run_time
+        self.stall = stall
+        self.cancel_at_backend = cancel
+        self._backend = backend or FauxBackend()
+        self._cancelled = False
+        self.submitted = monotonic()
+        self.status_calls = 0           # every status(), done(), in_final_state() or cancelled() call
+
+    def job_id(self):
+        return 'faux-' + (self._job.job_id() if self._job is not None else 'job')
+
+    def backend(self):
+        return self._backend
+
+    def status(self):
+        self.status_calls += 1
+        elapsed = monotonic() - self.submitted
+        if self._cancelled:
+            return 'CANCELLED'
+        if elapsed < self.queue_time:
+            return 'QUEUED'
+        if self.cancel_at_backend:
+            self._cancelled = True
+            return 'CANCELLED'
+        if self.stall or elapsed < self.queue_time + self.run_time:
+            return 'RUNNING'
+        if self._job is None:
+            return 'DONE'
+        status = self._job.status()
+        return getattr(status, 'name', str(status))
+
+    def done(self):
+        return self.status() == 'DONE'
+
+    def in_final_state(self):
+        return self.status() in ('DONE', 'CANCELLED', 'ERROR')
+
+    def cancelled(self):
+        return self.status() == 'CANCELLED'
+
+    def cancel(self):
+        self._cancelled = True
+
+    def result(self):
+        return self._job.result()
@@ -0,0 +1,79 @@
+#----------------------------------------------------------------------
+#     neopixel_faux.py
+#       a pure-Python stand-in for the neopixel_spi library (adafruit_circuitpython_neopixel_spi)
+#
+#   Used by QuantumRaspberryTie with the -neofaux option so the NeoPixel display path can be run,
+#   and its throughput measured, on a machine with no SPI bus or LED array attached.
+#
+#   It keeps the same pixel buffer layout as the real library (one bytearray, pixel_order byte
+#   order, brightness already applied) and counts what show() would have sent.
+#----------------------------------------------------------------------
+
+from time import monotonic
+
+# pixel orders, as in neopixel_spi
+RGB = "RGB"
+GRB = "GRB"
+RGBW = "RGBW"
+GRBW = "GRBW"
+
+
+class NeoPixel_SPI():
+    def __init__(self, spi, n, *, bpp=3, brightness=1.0, auto_write=True, pixel_order=None, **kwargs):
+        if pixel_order is None:
+            pixel_order = GRB if bpp == 3 else GRBW
+        self.n = n
+        self.pixel_order = pixel_order
+        self._bpp = len(pixel_order)
+        self._byteorder = tuple(pixel_order.index(c) for c in "RGB")
+        self._offset = 0
+        self._brightness = brightness
+        self._post_brightness_buffer = bytearray(n * self._bpp)
+        self.auto_write = auto_write
+        self.shows = 0          # number of show() calls
+        self.bytes_sent = 0     # bytes that would have gone out over SPI
+        self.started = monotonic()
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        self._brightness = min(max(value, 0.0), 1.0)
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, index, value):
+        start = self._offset + index * self._bpp
+        for channel, level in zip(self._byteorder, value[:3]):
+            self._post_brightness_buffer[start + channel] = int(level * self._brightness)
+        if self.auto_write:
+            self.show()
+
+    def __getitem__(self, index):
+        start = self._offset + index * self._bpp
+        return tuple(self._post_brightness_buffer[start + channel] for channel in self._byteorder)
+
+    def fill(self, color):
+        auto_write = self.auto_write
+        self.auto_write = False
+        for index in range(self.n):
+            self[index] = color
+        self.auto_write = auto_write
+        if auto_write:
+            self.show()
+
+    def show(self):
+        # the real library expands every bit into SPI symbols here; copying the buffer stands in for the send
+        sent = bytes(self._post_brightness_buffer)
+        self.shows += 1
+        self.bytes_sent += len(sent)
+
+    def stats(self):
+        elapsed = max(monotonic() - self.started, 1e-9)
+        return f"{self.shows} frames, {self.bytes_sent} bytes ({self.shows / elapsed:.1f} frames/s)"
+
+    def deinit(self):
+        pass
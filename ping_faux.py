@@ -0,0 +1,81 @@
+#----------------------------------------------------------------------
+#     ping_faux.py
+#       a stand-in for the IBM Quantum web server, for exercising the connectivity check offline
+#
+#   Used by QuantumRaspberryTie with the -pingfaux option (or run on its own and pointed at with
+#   -pingurl:http://127.0.0.1:port/). FauxServer answers every HEAD and GET with a chosen status
+#   code after an optional delay, so the health checker's keep-alive, timeouts and cached answers
+#   can be checked without a network. The status and delay can be changed while it runs.
+#
+#   Every request is counted by method, along with the connections opened, so connection reuse
+#   shows up as many requests over few connections.
+#
+#   On its own:  python ping_faux.py [port] [status] [delay seconds]
+#----------------------------------------------------------------------
+
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from time import sleep
+
+
+class FauxServer():
+    def __init__(self, port=0, status=200, delay=0.0, host='127.0.0.1'):
+        self.status = status            # code returned to every request
+        self.delay = delay              # seconds to wait before answering
+        self.requests = {}              # method -> count
+        self.connections = 0
+        self.lock = Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'       # keep-alive, like the real server
+
+            def setup(self):
+                super().setup()
+                with server.lock: server.connections += 1
+
+            def answer(self, body):
+                with server.lock:
+                    server.requests[self.command] = server.requests.get(self.command, 0) + 1
+                if server.delay: sleep(server.delay)
+                payload = b'faux quantum server\n'
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                if body: self.wfile.write(payload)
+
+            def do_HEAD(self):  self.answer(False)
+            def do_GET(self):   self.answer(True)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/"
+
+    def start(self):
+        Thread(target=self.httpd.serve_forever, name="ping_faux", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'connections': self.connections, **self.requests}
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    status = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    server = FauxServer(port, status, delay)
+    print("faux quantum server answering", status, "at", server.url)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())